@@ -4,30 +4,256 @@ AI-Sheet-Pro AI 代理（增强版）
 """
 
 import os
+import re
 import json
+import asyncio
+import hashlib
+import contextlib
+from collections import OrderedDict, deque
+from itertools import islice
 import httpx
+import orjson
+import pandas as pd
 import yaml
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 from db_engine import get_engine, DataEngine
 from sandbox import get_sandbox, CodeSandbox
 from logger import get_logger
+from ui_commands import get_ui_queue
+from undo_manager import get_undo_manager
+
+
+PROMPTS_PATH = Path(__file__).parent / "prompts.yaml"
+# 由 prompts.yaml 编译出的 JSON 副本（不纳入版本管理），加载速度远快于 YAML 解析
+PROMPTS_JSON_PATH = PROMPTS_PATH.with_suffix('.json')
+CONFIG_PATH = Path(__file__).parent / 'taskweaver_config' / 'taskweaver_config.json'
+
+# 文件解析结果缓存 {path: (mtime_ns, data)}
+_file_cache: Dict[Path, tuple] = {}
+
+
+def _load_cached(path: Path, loader: Callable[[Path], Any]) -> Any:
+    """按 mtime 缓存文件解析结果，文件未变化时（如 reload_agent）直接复用"""
+    mtime = path.stat().st_mtime_ns
+    cached = _file_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    data = loader(path)
+    _file_cache[path] = (mtime, data)
+    return data
+
+
+def _compile_prompts(yaml_path: Path) -> dict:
+    """YAML 仍是唯一的编辑源；JSON 副本过期时才重新解析 YAML 并写回"""
+    if PROMPTS_JSON_PATH.exists() and PROMPTS_JSON_PATH.stat().st_mtime_ns >= yaml_path.stat().st_mtime_ns:
+        return orjson.loads(PROMPTS_JSON_PATH.read_bytes())
+    with open(yaml_path, 'r', encoding='utf-8') as f:
+        prompts = yaml.safe_load(f)
+    try:
+        PROMPTS_JSON_PATH.write_bytes(orjson.dumps(prompts))
+    except OSError:
+        pass  # 目录只读时下次仍从 YAML 解析
+    return prompts
 
 
 # 加载 Prompt 配置文件
 def load_prompts():
-    """从外部 YAML 文件加载系统提示词"""
-    prompts_path = Path(__file__).parent / "prompts.yaml"
+    """从外部 YAML 文件加载系统提示词
+    
+    只有文件缺失时返回空配置；YAML 语法错误等直接抛出，避免带着空提示词白跑 LLM 调用。
+    """
     try:
-        with open(prompts_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
-    except Exception as e:
-        print(f"Warning: Failed to load prompts.yaml: {e}")
+        return _load_cached(PROMPTS_PATH, _compile_prompts) or {}
+    except FileNotFoundError:
+        get_logger().add_log("ERROR", f"提示词文件不存在: {PROMPTS_PATH}")
         return {}
 
 _PROMPTS = load_prompts()
 SYSTEM_PROMPT = _PROMPTS.get('system_prompt', '')
 SEMANTIC_MAPPING_PROMPT = _PROMPTS.get('semantic_mapping_prompt', '')
+if not SYSTEM_PROMPT:
+    get_logger().add_log("ERROR", "system_prompt 为空，AI 查询将直接返回配置错误")
+
+
+# OpenAI 兼容的工具定义：模型可在同一步中并行发起多个 tool_calls
+TOOL_SCHEMAS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "inspect_data",
+            "description": "查看列的前 n 个唯一值，用于确认列中实际存储的值；需要看多列时用 columns 一次传入",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "table_name": {"type": "string", "description": "表名"},
+                    "column_name": {"type": "string", "description": "列名"},
+                    "n": {"type": "integer", "description": "返回的唯一值数量", "default": 10},
+                    "columns": {
+                        "type": "array",
+                        "description": "批量探查：多列合并为一次查询",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "table_name": {"type": "string"},
+                                "column_name": {"type": "string"},
+                                "n": {"type": "integer", "default": 10}
+                            },
+                            "required": ["table_name", "column_name"]
+                        }
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "execute_python",
+            "description": "执行 Python 数据分析代码，可用变量 db (DuckDB连接)、pd、np，结果赋值给 result",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "code": {"type": "string", "description": "要执行的 Python 代码"}
+                },
+                "required": ["code"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "execute_ui_command",
+            "description": "执行前端 UI 格式化命令，参数为完整的 UI 命令对象",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "description": "UI 命令名，如 setHeaderStyle"}
+                },
+                "required": ["action"],
+                "additionalProperties": True
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "finish",
+            "description": "结束任务并返回最终结果给用户",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "type": {
+                        "type": "string",
+                        "enum": ["answer", "data", "ui", "clarify", "error"],
+                        "description": "响应类型"
+                    },
+                    "answer": {"type": "string", "description": "给用户看的文本回答"},
+                    "temp_table": {"type": "string", "description": "创建的临时表名（可选）"}
+                },
+                "required": ["type", "answer"]
+            }
+        }
+    }
+]
+
+# 响应分类关键词
+_CLARIFY_KEYWORDS = ('请问', '请告诉我', '请指定', '请选择', '需要更多信息', '哪一列', '什么条件', '？')
+_ERROR_KEYWORDS = ('失败', '错误', 'error', 'failed', '无法', '不存在', '找不到')
+_DATA_KEYWORDS = ('删除', '更新', '修改', '添加', '插入', 'delete', 'update', 'insert', 'alter')
+
+
+def _keyword_pattern(**classes) -> re.Pattern:
+    """把多组关键词编译为一个带命名分组的正则，一次扫描即可得知命中了哪些类别"""
+    return re.compile('|'.join(
+        f"(?P<{name}>{'|'.join(map(re.escape, keywords))})"
+        for name, keywords in classes.items()
+    ))
+
+
+_EXPLANATION_CLASSIFIER = _keyword_pattern(clarify=_CLARIFY_KEYWORDS, error=_ERROR_KEYWORDS)
+_DATA_CLASSIFIER = _keyword_pattern(data=_DATA_KEYWORDS)
+
+# LLM 回复中 ```json ... ``` 代码块
+_JSON_BLOCK = re.compile(r"```json\s*(.*?)\s*```", re.S)
+
+# 会被收集并下发给前端的 UI 命令
+_UI_ACTIONS = frozenset({
+    'setHeaderStyle', 'freezeColumns', 'setConditionalFormat',
+    'setBorder', 'hideRowsWhere', 'sortByColumn',
+})
+
+# 只读且结果确定的工具，允许在 LLM 生成期间预先执行
+READONLY_TOOLS = frozenset({'inspect_data'})
+# 每次查询最多预取的列数
+MAX_PREFETCH_INSPECTIONS = 4
+
+# 会话历史保留的轮数
+MAX_CONVERSATION_HISTORY = 32
+# 发送给 LLM 的消息超过该数量时，压缩较早的 Observation
+MAX_PROMPT_MESSAGES = 12
+# 压缩时保留原文的最近 Observation 数
+KEEP_RECENT_OBSERVATIONS = 4
+# 返回给前端的思考轨迹条数
+MAX_RETURNED_TRAJECTORY = 5
+# execute_python 观察结果中表格/集合最多展示的行（项）数
+OBSERVATION_HEAD_ROWS = 20
+# 其他结果转文本后的最大长度
+MAX_OBSERVATION_CHARS = 500
+
+# DuckDB 写操作锁（按连接区分）：并行工具调用中会写数据的 execute_python 串行执行
+_DB_WRITE_LOCKS: Dict[int, asyncio.Lock] = {}
+
+
+def _get_write_lock(conn) -> asyncio.Lock:
+    return _DB_WRITE_LOCKS.setdefault(id(conn), asyncio.Lock())
+
+
+def _summarize_result(res_val: Any) -> str:
+    """生成 execute_python 结果的观察摘要
+    
+    按集合自身长度判断是否截断，只对前几行做字符串化，不对整个大结果求 repr。
+    """
+    n = OBSERVATION_HEAD_ROWS
+    if isinstance(res_val, (pd.DataFrame, pd.Series)):
+        suffix = f"\n... (共 {len(res_val)} 行)" if len(res_val) > n else ""
+        return res_val.head(n).to_string() + suffix
+    if isinstance(res_val, dict) and res_val.get('type') == 'dataframe':
+        # 沙箱已把 DataFrame 转为 {'type', 'data_soa', 'columns', 'shape'}（按列组织）
+        data = res_val.get('data_soa') or {}
+        head = pd.DataFrame({col: values[:n] for col, values in data.items()}).to_string()
+        total = res_val.get('shape', (0,))[0]
+        suffix = f"\n... (共 {total} 行)" if total > n else ""
+        return head + suffix
+    if isinstance(res_val, (list, tuple)) and len(res_val) > n:
+        return f"{res_val[:n]} ... (共 {len(res_val)} 项)"
+    if isinstance(res_val, dict) and len(res_val) > n:
+        return f"{dict(islice(res_val.items(), n))} ... (共 {len(res_val)} 项)"
+    
+    text = str(res_val)
+    if len(text) > MAX_OBSERVATION_CHARS:
+        return f"Result (truncated): {text[:MAX_OBSERVATION_CHARS]}..."
+    return text
+
+
+# DuckDB 关系 API 的写方法：目标表可能由变量或拼接给出，无法从代码文本可靠判断
+_RELATION_WRITE_RE = re.compile(
+    r'\.(insert_into|insert|to_table|to_view|create_view|create_table|create)\s*\('
+)
+
+
+def _referenced_tables(code: str, tables: List[str]) -> List[str]:
+    """找出代码中以完整标识符出现的表名（DuckDB 标识符不区分大小写）
+    
+    一个都找不到时（如表名动态拼接），或代码调用了关系 API 的写方法时，保守地返回全部表。
+    """
+    if _RELATION_WRITE_RE.search(code):
+        return tables
+    referenced = [
+        t for t in tables
+        if re.search(rf'(?<![\w]){re.escape(t)}(?![\w])', code, re.IGNORECASE)
+    ]
+    return referenced or tables
 
 
 class LLMClient:
@@ -37,27 +263,99 @@ class LLMClient:
         self.api_base = api_base.rstrip('/')
         self.api_key = api_key
         self.model = model
-        self.client = httpx.Client(timeout=60.0)
+        # 异步客户端：多个用户查询可在同一事件循环上重叠等待 LLM 网络 I/O。
+        # HTTP/2 让并发的 ReAct 请求复用同一条 TLS 连接；传输层重试吸收短暂的网络抖动，
+        # 不必让整个 ReAct 循环失败重来。
+        self.client = httpx.AsyncClient(
+            base_url=self.api_base,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            timeout=60.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=300)
+            )
+        )
+        # 每次请求都相同的 payload 字段
+        self._base_payload = {"model": model, "max_tokens": 2000}
     
-    def chat(self, messages: List[dict], temperature: float = 0.7) -> str:
+    async def chat(self, messages: List[dict], temperature: float = 0.7) -> str:
         """发送聊天请求"""
-        url = f"{self.api_base}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": 2000
-        }
+        message = await self._complete(messages, temperature)
+        return message["content"]
+    
+    async def chat_with_tools(self, messages: List[dict], tools: List[dict],
+                              temperature: float = 0.7,
+                              should_stop: Optional[Callable[[dict], bool]] = None) -> dict:
+        """以流式 (SSE) 方式发送带工具定义的聊天请求
+        
+        Args:
+            should_stop: 每收到一个增量后以当前已拼装的消息调用；返回 True 时立即
+                断开流，不再等待剩余 token
+        
+        Returns:
+            assistant 消息字典（content 可能为空，tool_calls 可能包含多个并行调用）
+        """
+        payload = self._build_payload(messages, temperature, tools)
+        payload["stream"] = True
         
-        response = self.client.post(url, headers=headers, json=payload)
+        content_parts: List[str] = []
+        tool_calls: List[dict] = []
+        message = {"role": "assistant", "content": None}
+        
+        async with self.client.stream("POST", "/chat/completions", content=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta") or {}
+                
+                if delta.get("content"):
+                    content_parts.append(delta["content"])
+                    message["content"] = "".join(content_parts)
+                for tc_delta in delta.get("tool_calls") or []:
+                    index = tc_delta.get("index", len(tool_calls))
+                    while len(tool_calls) <= index:
+                        tool_calls.append({"id": None, "type": "function",
+                                           "function": {"name": "", "arguments": ""}})
+                    call = tool_calls[index]
+                    if tc_delta.get("id"):
+                        call["id"] = tc_delta["id"]
+                    function = tc_delta.get("function") or {}
+                    call["function"]["name"] += function.get("name") or ""
+                    call["function"]["arguments"] += function.get("arguments") or ""
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                
+                if should_stop and should_stop(message):
+                    # 退出 async with 即关闭连接，服务端停止继续生成
+                    break
+        
+        return message
+    
+    def _build_payload(self, messages: List[dict], temperature: float,
+                       tools: Optional[List[dict]] = None) -> dict:
+        payload = {**self._base_payload, "messages": messages, "temperature": temperature}
+        if tools:
+            payload["tools"] = tools
+        return payload
+    
+    async def _complete(self, messages: List[dict], temperature: float) -> dict:
+        payload = self._build_payload(messages, temperature)
+        response = await self.client.post("/chat/completions", content=orjson.dumps(payload))
         response.raise_for_status()
         
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        result = orjson.loads(response.content)
+        return result["choices"][0]["message"]
 
 
 # 注意: SYSTEM_PROMPT 和 SEMANTIC_MAPPING_PROMPT 现在从 prompts.yaml 文件加载
@@ -68,20 +366,36 @@ class LLMClient:
 class AIAgent:
     """AI 代理 - 基于 ReAct 架构的智能体"""
     
+    __slots__ = (
+        'engine', 'sandbox', 'config', 'llm_client', 'conversation_history',
+        'pending_execution', '_context_cache', '_inspection_cache', '_exec_cache', '_tools',
+    )
+    
     def __init__(self):
         self.engine = get_engine()
         self.sandbox = get_sandbox()
         self.config = self._load_config()
         self.llm_client = self._init_llm_client()
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=MAX_CONVERSATION_HISTORY)
         self.pending_execution = None  # 待确认执行的代码
+        # 数据上下文缓存 ((表名元组, 元数据版本), 上下文文本)
+        self._context_cache: Optional[tuple] = None
+        # 推测执行的 inspect_data 结果 {(table, column, n): Task}
+        self._inspection_cache: Dict[tuple, asyncio.Task] = {}
+        # 只读代码的执行结果 {(元数据版本, 代码摘要): result}，每次 ReAct 运行开始时清空
+        self._exec_cache: Dict[tuple, Dict[str, Any]] = {}
+        # 工具分发表 {工具名: 处理方法}
+        self._tools: Dict[str, Callable] = {
+            'inspect_data': self._tool_inspect,
+            'execute_python': self._tool_exec_py,
+            'execute_ui_command': self._tool_ui,
+            'finish': self._tool_finish,
+        }
     
     def _load_config(self) -> dict:
         """加载配置"""
-        config_path = Path(__file__).parent / 'taskweaver_config' / 'taskweaver_config.json'
-        if config_path.exists():
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        if CONFIG_PATH.exists():
+            return _load_cached(CONFIG_PATH, lambda path: orjson.loads(path.read_bytes()))
         return {}
     
     def _init_llm_client(self) -> Optional[LLMClient]:
@@ -91,123 +405,291 @@ class AIAgent:
         model = self.config.get('llm.model', 'deepseek-chat')
         
         if api_base and api_key:
-            return LLMClient(api_base, api_key, model)
+            return _get_llm_client(api_base, api_key, model)
         return None
     
     def get_context(self) -> str:
-        """获取当前数据上下文"""
+        """获取当前数据上下文
+        
+        表集合与元数据版本不变时返回同一个字符串对象，保证发给 LLM 的
+        消息前缀逐字节稳定，命中服务端的前缀缓存。
+        """
         self.engine.refresh_metadata()
         tables = self.engine.get_all_tables()
-        if not tables:
-            return "当前没有加载任何数据表。"
+        key = (tuple(tables), self.engine.metadata_version)
+        if self._context_cache and self._context_cache[0] == key:
+            return self._context_cache[1]
         
-        context = "## 已加载的数据表\n\n"
-        for table_name in tables:
-            context += self.engine.describe_table(table_name) + "\n---\n"
+        if not tables:
+            context = "当前没有加载任何数据表。"
+        else:
+            parts = [self.engine.describe_table(table_name) for table_name in tables]
+            context = "## 已加载的数据表\n\n" + "".join(f"{part}\n---\n" for part in parts)
+        self._context_cache = (key, context)
         return context
     
-    def execute_tool(self, action: str, action_input: dict) -> str:
-        """执行工具调用"""
+    async def _execute_code(self, code: str) -> Dict[str, Any]:
+        """在线程池中运行沙箱代码，避免阻塞事件循环
+        
+        DuckDB 连接对象不是线程安全的，工作线程使用独立游标（共享同一数据库）。
+        只读代码的成功结果会被缓存，同一次运行中重复的查询（以及随后 confirm 时的重放）直接复用。
+        """
+        read_only = self.sandbox.is_read_only(code)
+        key = (self.engine.metadata_version, hashlib.blake2b(code.encode(), digest_size=16).digest())
+        if read_only and key in self._exec_cache:
+            return self._exec_cache[key]
+        
+        # 每次执行使用独立游标，只读代码可以并行；只有写操作需要串行
+        lock = contextlib.nullcontext() if read_only else _get_write_lock(self.engine.conn)
+        async with lock:
+            cursor = self.engine.conn.cursor()
+            try:
+                result = await asyncio.to_thread(
+                    self.sandbox.execute, code, local_vars={}, db_connection=cursor
+                )
+            finally:
+                cursor.close()
+        
+        if not read_only:
+            # 写操作之后旧的读结果可能已失效（包括引擎的查询结果缓存）
+            self._exec_cache.clear()
+            self.engine.mark_modified()
+        elif result.get('success'):
+            self._exec_cache[key] = result
+        return result
+
+    def _prefetch_inspections(self, query: str, tables: List[str]) -> None:
+        """推测执行：在等待 LLM 时预先探查问题中提到的列
+        
+        inspect_data 只读且结果只取决于 (table, column, n)，因此可以安全地提前执行；
+        LLM 真正请求时直接复用结果。execute_python 有副作用，不做推测。
+        """
+        query_lower = query.lower()
+        candidates = [
+            (table_name, col)
+            for table_name in tables
+            for col in self.engine.tables[table_name]['column_names']
+            if str(col).lower() in query_lower
+        ][:MAX_PREFETCH_INSPECTIONS]
+        
+        for table_name, col in candidates:
+            key = (table_name, col, 10)
+            if key in self._inspection_cache:
+                continue
+            task = asyncio.create_task(asyncio.to_thread(self.engine.inspect_column, *key))
+            # 预取失败时异常留待真正调用时抛出，这里只避免 "never retrieved" 警告
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inspection_cache[key] = task
+    
+    async def _inspect(self, table_name: str, column_name: str, n: int) -> List[Any]:
+        key = (table_name, column_name, int(n))
+        task = self._inspection_cache.get(key)
+        if task is None:
+            task = asyncio.create_task(asyncio.to_thread(self.engine.inspect_column, *key))
+            self._inspection_cache[key] = task
+        return await task
+
+    async def _inspect_batch(self, columns: List[dict]) -> Dict[str, List[Any]]:
+        """批量探查：与单列探查共用缓存（键为 (table, column, n)），未命中的列合并为一条 SQL"""
+        specs = list(dict.fromkeys(
+            (c.get('table_name'), c.get('column_name'), int(c.get('n', 10))) for c in columns
+        ))
+        missing = [key for key in specs if key not in self._inspection_cache]
+        if missing:
+            batch = asyncio.create_task(asyncio.to_thread(self.engine.inspect_columns, missing))
+            
+            async def pick(key):
+                return (await batch)[key]
+            
+            # 每列登记一个取自批量结果的任务，之后的单列或批量探查直接复用
+            for key in missing:
+                self._inspection_cache[key] = asyncio.create_task(pick(key))
+        
+        values = await asyncio.gather(*(self._inspection_cache[key] for key in specs), return_exceptions=True)
+        for value in values:
+            if isinstance(value, BaseException):
+                raise value
+        return {f"{t}.{c}": value for (t, c, _), value in zip(specs, values)}
+
+    async def execute_tool(self, action: str, action_input: dict) -> str:
+        """执行工具调用（按工具名查表分发）"""
+        handler = self._tools.get(action)
+        if handler is None:
+            return f"Apps Error: Unknown tool '{action}'"
+        return await handler(action_input)
+
+    async def _tool_inspect(self, action_input: dict) -> str:
         try:
-            if action == 'inspect_data':
-                return str(self.engine.inspect_column(
-                    action_input.get('table_name'), 
-                    action_input.get('column_name'),
-                    action_input.get('n', 10)
-                ))
-                
-            elif action == 'execute_python':
-                code = action_input.get('code', '')
-                try:
-                    # 预检查代码安全性
-                    is_safe, error = self.sandbox.validate_code(code)
-                    if not is_safe:
-                        return f"Security Error: {error}"
-                    
-                    # 在沙箱中尝试预运行（不提交事务，或仅作为语法检查）
-                    # 注意：为了 ReAct 自愈，我们可能需要真正执行一步来看看是否报错
-                    # 但对于 data modification，这可能导致副作用。
-                    # ReAct 的 execute_python 工具在“思考”阶段是否应该真正执行？
-                    # 策略：真正执行。如果用户反悔，使用 Undo。
-                    
-                    # 为了安全，我们捕获执行结果但不持久化（除非是 finish）
-                    # 在 ReAct 中，中间步骤的 execute_python 通常是为了做计算
-                    # 如果包含写操作（DELETE/UPDATE），应该警告？ 
-                    # 简化起见：允许执行。Undo Manager 会在 confirm_and_execute 中统一处理 Snapshot，
-                    # 但在这里是在 ReAct 循环内部...
-                    
-                    # 改进策略：ReAct 内部的 execute_python 应该只用于“查看/计算”。
-                    # 真正的写操作代码，应该被作为 Final Answer 返回，由 confirm_and_execute 统一执行。
-                    # 或者，我们允许 ReAct 逐步执行，但每一步都记录。
-                    
-                    # 当前 Prompts 定义：execute_python 用于清洗、计算。
-                    # 我们暂时就在沙箱跑，如果出错返回 Error 给 AI。
-                    
-                    result = self.sandbox.execute(
-                        code,
-                        local_vars={},
-                        db_connection=self.engine.conn
-                    )
-                    
-                    if not result['success']:
-                        return f"Execution Error: {result['error']}"
-                    
-                    # 返回结果摘要
-                    res_val = result.get('result')
-                    if hasattr(res_val, '__len__') and len(str(res_val)) > 500:
-                        return f"Result (truncated): {str(res_val)[:500]}..."
-                    return str(res_val)
-                    
-                except Exception as e:
-                    return f"Runtime Error: {str(e)}"
-                    
-            elif action == 'execute_ui_command':
-                # UI 命令真正加入队列
-                from ui_commands import get_ui_queue
-                get_ui_queue().add(action_input)
-                return "UI command queued."
-                
-            elif action == 'finish':
-                return "Task Loop Finished"
-                
-            else:
-                return f"Apps Error: Unknown tool '{action}'"
-                
+            if action_input.get('columns'):
+                return str(await self._inspect_batch(action_input['columns']))
+            return str(await self._inspect(
+                action_input.get('table_name'), 
+                action_input.get('column_name'),
+                action_input.get('n', 10)
+            ))
         except Exception as e:
             return f"Tool Error: {str(e)}"
 
-    def run_react_loop(self, query: str) -> Dict[str, Any]:
-        """运行 ReAct 思考循环"""
+    async def _tool_exec_py(self, action_input: dict) -> str:
+        code = action_input.get('code', '')
+        try:
+            # 预检查代码安全性
+            is_safe, error = self.sandbox.validate_code(code)
+            if not is_safe:
+                return f"Security Error: {error}"
+            
+            # 在沙箱中尝试预运行（不提交事务，或仅作为语法检查）
+            # 注意：为了 ReAct 自愈，我们可能需要真正执行一步来看看是否报错
+            # 但对于 data modification，这可能导致副作用。
+            # ReAct 的 execute_python 工具在“思考”阶段是否应该真正执行？
+            # 策略：真正执行。如果用户反悔，使用 Undo。
+            
+            # 为了安全，我们捕获执行结果但不持久化（除非是 finish）
+            # 在 ReAct 中，中间步骤的 execute_python 通常是为了做计算
+            # 如果包含写操作（DELETE/UPDATE），应该警告？ 
+            # 简化起见：允许执行。Undo Manager 会在 confirm_and_execute 中统一处理 Snapshot，
+            # 但在这里是在 ReAct 循环内部...
+            
+            # 改进策略：ReAct 内部的 execute_python 应该只用于“查看/计算”。
+            # 真正的写操作代码，应该被作为 Final Answer 返回，由 confirm_and_execute 统一执行。
+            # 或者，我们允许 ReAct 逐步执行，但每一步都记录。
+            
+            # 当前 Prompts 定义：execute_python 用于清洗、计算。
+            # 我们暂时就在沙箱跑，如果出错返回 Error 给 AI。
+            
+            result = await self._execute_code(code)
+            
+            if not result['success']:
+                return f"Execution Error: {result['error']}"
+            
+            # 返回结果摘要
+            return _summarize_result(result.get('result'))
+            
+        except Exception as e:
+            return f"Runtime Error: {str(e)}"
+
+    async def _tool_ui(self, action_input: dict) -> str:
+        try:
+            # UI 命令真正加入队列
+            get_ui_queue().add(action_input)
+            return "UI command queued."
+        except Exception as e:
+            return f"Tool Error: {str(e)}"
+
+    async def _tool_finish(self, action_input: dict) -> str:
+        return "Task Loop Finished"
+
+    async def run_react_loop(self, query: str,
+                             on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """运行 ReAct 思考循环
+        
+        Args:
+            on_event: 可选回调，每一步的思考、工具调用与观察产生时立即调用（用于流式推送进度）
+        """
         context = self.get_context()
         tables = self.engine.get_all_tables()
         
         if not self.llm_client:
             return self._fallback_generate(query, tables)
+        
+        if not SYSTEM_PROMPT:
+            # 没有系统提示词时模型输出无法解析，进入循环只会白白消耗每一步的 LLM 调用
+            message = "AI 配置错误：未加载到系统提示词 (prompts.yaml)"
+            return {
+                'response_type': 'error',
+                'answer': message,
+                'temp_table': None,
+                'thinking': [],
+                'code': '',
+                'commands': [],
+                'llm_used': False,
+                'type': 'mixed',
+                'explanation': message
+            }
             
+        # 消息顺序按稳定程度排列：系统提示词（永不变）→ 数据上下文（同一数据状态下不变）
+        # → 问题与后续观察。前缀中不得插入时间戳等易变内容，以便命中 DeepSeek 的前缀缓存。
         messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": f"## Context\n{context}\n\n## Question\n{query}"}
+            {"role": "system", "content": f"## Context\n{context}"},
+            {"role": "user", "content": f"## Question\n{query}"}
         ]
         
         max_steps = 5
         final_response = None
         
+        # 预取结果只在本轮查询内有效
+        self._inspection_cache = {}
+        self._exec_cache.clear()
+        self._prefetch_inspections(query, tables)
+        
         # 记录 ReAct 轨迹
         trajectory = []
         
+        # 由于我们是在 ReAct 中即时执行了 Python，所以 final_response 中的 code 可能是空的
+        # 这对于 confirm_and_execute 模式是个问题，因为那里期望的是“待确认的代码”
+        # 
+        # 修正策略：
+        # 对于 query 模式（ai_query），ReAct 已经在过程中执行了，结果在 conversation 中。
+        # 对于 preview 模式（ai_preview），我们不应该在 ReAct 中真正执行写操作 (DELETE/UPDATE)。
+        # 
+        # 这是一个两难：ReAct 需要执行才能看到结果（Observation），但 Preview 需要先不执行。
+        # 
+        # 妥协方案：
+        # ReAct 模式主要用于“增强的 Query 和 Analysis”。
+        # 如果涉及“写操作”，我们指示 Prompt 在 finish 时输出最终代码，而不只是在过程中执行。
+        # 这里在解析每一步工具调用时，顺带收集 ReAct 过程中执行过的所有 Python 代码块与 UI 命令。
+        collected_code = []
+        collected_commands = []
+        
         for step in range(max_steps):
-            # 1. LLM 思考
-            response_text = self.llm_client.chat(messages, temperature=0.3)
+            if len(messages) > MAX_PROMPT_MESSAGES:
+                self._compact_observations(messages)
+            
+            # 1. LLM 思考（可能一次返回多个并行的 tool_calls）
+            message = await self.llm_client.chat_with_tools(
+                messages, TOOL_SCHEMAS, temperature=0.3,
+                should_stop=self._is_step_complete
+            )
+            response_text = message.get('content') or ''
+            tool_calls = message.get('tool_calls') or []
             trajectory.append(f"Step {step+1}: {response_text}")
-            get_logger().add_log("REACT_STEP", f"Step {step+1}", details=response_text)
+            get_logger().add_log("REACT_STEP", f"Step {step+1}", details=message)
+            if on_event:
+                on_event({'event': 'thought', 'step': step + 1, 'content': response_text})
+            
+            # 流中未带 id 的工具调用补一个 id：回传的 tool_calls 与随后的 tool 消息必须一一对应
+            for i, tc in enumerate(tool_calls):
+                if not tc.get('id'):
+                    tc['id'] = f"call_{step + 1}_{i}"
             
-            # 将回复加入历史
-            messages.append({"role": "assistant", "content": response_text})
+            # 将回复加入历史（tool_calls 必须原样回传，后续 tool 消息才能对应）
+            assistant_message = {"role": "assistant", "content": response_text}
+            if tool_calls:
+                assistant_message["tool_calls"] = tool_calls
+            messages.append(assistant_message)
+            
+            # 2. 解析工具调用；模型未使用 tool calling 时回退到文本格式解析
+            if tool_calls:
+                calls = [
+                    (tc['id'], tc['function']['name'], self._load_tool_arguments(tc['function']['arguments']))
+                    for tc in tool_calls
+                ]
+                for _, action, action_input in calls:
+                    trajectory.append(f"Action: {action}\nAction Input: {json.dumps(action_input, ensure_ascii=False)}")
+            else:
+                parsed = self._parse_react_response(response_text)
+                calls = [(None, parsed['action'], parsed['action_input'])] if parsed else []
             
-            # 2. 解析 Thought/Action
-            parsed = self._parse_react_response(response_text)
+            for _, action, action_input in calls:
+                if on_event:
+                    on_event({'event': 'action', 'step': step + 1, 'action': action, 'action_input': action_input})
+                if action == 'execute_python' and 'code' in action_input:
+                    collected_code.append(action_input['code'])
+                elif action == 'execute_ui_command' and action_input.get('action') in _UI_ACTIONS:
+                    collected_commands.append(action_input)
             
-            if not parsed:
+            if not calls:
                 # AI 没有遵循格式，可能直接给了答案，或者格式错了
                 # 尝试当作直接回答处理
                 final_response = {
@@ -218,9 +700,32 @@ class AIAgent:
                 }
                 break
                 
-            if parsed['action'] == 'finish':
+            # 3. 并行执行本步中除 finish 以外的全部工具调用
+            tool_steps = [c for c in calls if c[1] != 'finish']
+            observations = await asyncio.gather(
+                *[self.execute_tool(action, action_input) for _, action, action_input in tool_steps]
+            )
+            
+            # 4. 反馈 Observation
+            for (call_id, action, _), observation in zip(tool_steps, observations):
+                obs_message = f"Observation: {observation}"
+                if call_id:
+                    messages.append({"role": "tool", "tool_call_id": call_id, "content": str(observation)})
+                else:
+                    messages.append({"role": "user", "content": obs_message})
+                trajectory.append(obs_message)
+                if on_event:
+                    on_event({'event': 'observation', 'step': step + 1, 'action': action,
+                              'content': str(observation)[:MAX_OBSERVATION_CHARS]})
+            
+            if any(c[1] not in READONLY_TOOLS for c in tool_steps):
+                # 非只读工具可能修改了数据，之前的探查结果不再可信
+                self._inspection_cache = {}
+            
+            finish_call = next((c for c in calls if c[1] == 'finish'), None)
+            if finish_call:
                 # 任务完成 - 从 AI 返回的结构化 JSON 中读取类型和答案
-                final_input = parsed['action_input']
+                final_input = finish_call[2]
                 # 🆕 直接读取 AI 标注的 type 字段（如果没有则回退到 answer）
                 ai_response_type = final_input.get('type', 'answer')
                 ai_answer = final_input.get('answer', final_input.get('final_answer', ''))
@@ -235,59 +740,7 @@ class AIAgent:
                 }
                 break
             
-            # 3. 执行工具
-            observation = self.execute_tool(parsed['action'], parsed['action_input'])
-            
-            # 记录工具调用的代码（如果是 python）以便后续可能的重放或审计
-            if parsed['action'] == 'execute_python':
-                # 这里有一个设计选择：是把所有步骤的代码拼起来，还是只保留最后一步？
-                # 对于数据分析（Query），最后一步通常够了。
-                # 对于数据处理（Update），每一行都重要。
-                # 简单起见，我们将所有执行成功的代码都视为最终结果的一部分。
-                if 'Execution Error' not in observation:
-                    pass 
-                
-            # 4. 反馈 Observation
-            obs_message = f"Observation: {observation}"
-            messages.append({"role": "user", "content": obs_message})
-            trajectory.append(obs_message)
-            
         # 构造最终返回
-        # 由于我们是在 ReAct 中即时执行了 Python，所以 final_response 中的 code 可能是空的
-        # 这对于 confirm_and_execute 模式是个问题，因为那里期望的是“待确认的代码”
-        # 
-        # 修正策略：
-        # 对于 query 模式（ai_query），ReAct 已经在过程中执行了，结果在 conversation 中。
-        # 对于 preview 模式（ai_preview），我们不应该在 ReAct 中真正执行写操作 (DELETE/UPDATE)。
-        # 
-        # 这是一个两难：ReAct 需要执行才能看到结果（Observation），但 Preview 需要先不执行。
-        # 
-        # 妥协方案：
-        # ReAct 模式主要用于“增强的 Query 和 Analysis”。
-        # 如果涉及“写操作”，我们指示 Prompt 在 finish 时输出最终代码，而不只是在过程中执行。
-        # 这里我们收集 ReAct 过程中执行过的所有 Python 代码块。
-        
-        collected_code = []
-        collected_commands = []
-        
-        # 简单的正则提取
-        import re
-        for msg in messages:
-            if msg['role'] == 'assistant':
-                content = msg['content']
-                # 提取 Action Input 中的 code
-                # 假设格式是 strict JSON in Action Input
-                action_match = re.search(r'Action Input: (\{.*?\})', content, re.DOTALL)
-                if action_match:
-                    try:
-                        inp = json.loads(action_match.group(1))
-                        if 'code' in inp:
-                            collected_code.append(inp['code'])
-                        if 'action' in inp and inp['action'] in ['setHeaderStyle', 'freezeColumns', 'setConditionalFormat', 'setBorder', 'hideRowsWhere', 'sortByColumn']:
-                             collected_commands.append(inp)
-                    except:
-                        pass
-        
         full_code = "\n".join(collected_code)
         explanation = final_response.get('explanation', '') if final_response else "ReAct 循环结束"
         
@@ -300,11 +753,13 @@ class AIAgent:
             # 回退：使用后端关键词分类（兼容旧版 AI 响应）
             response_type = self._classify_response_type(explanation, full_code, collected_commands)
         
+        self.conversation_history.append({'query': query, 'response_type': response_type, 'answer': explanation})
+        
         return {
             'response_type': response_type,  # 🆕 核心：AI 自主标注的类型
             'answer': explanation,           # 给用户看的文本答案
             'temp_table': final_response.get('temp_table') if final_response else None, # 🆕 传递临时表名
-            'thinking': trajectory,          # AI 思考过程（可隐藏）
+            'thinking': trajectory[-MAX_RETURNED_TRAJECTORY:],  # AI 思考过程（可隐藏，仅保留最近几条）
             'code': full_code,
             'commands': collected_commands,
             'llm_used': True,
@@ -317,14 +772,16 @@ class AIAgent:
         """智能分类 AI 响应类型"""
         explanation_lower = explanation.lower() if explanation else ''
         
-        # 1. 追问类：检测疑问句或请求更多信息
-        clarify_keywords = ['请问', '请告诉我', '请指定', '请选择', '需要更多信息', '哪一列', '什么条件', '？']
-        if any(kw in explanation for kw in clarify_keywords):
-            return 'clarify'
+        # 单次扫描收集命中的类别（追问类关键词均为中文，不受小写化影响）
+        hits = set()
+        for match in _EXPLANATION_CLASSIFIER.finditer(explanation_lower):
+            # 1. 追问类：检测疑问句或请求更多信息（优先级最高，命中即返回）
+            if match.lastgroup == 'clarify':
+                return 'clarify'
+            hits.add(match.lastgroup)
         
         # 2. 错误类：执行失败
-        error_keywords = ['失败', '错误', 'error', 'failed', '无法', '不存在', '找不到']
-        if any(kw in explanation_lower for kw in error_keywords):
+        if 'error' in hits:
             return 'error'
         
         # 3. UI 命令类：有 UI 命令且无数据代码
@@ -332,8 +789,7 @@ class AIAgent:
             return 'ui'
         
         # 4. 数据操作类：有代码执行
-        data_keywords = ['删除', '更新', '修改', '添加', '插入', 'delete', 'update', 'insert', 'alter']
-        if code and any(kw in code.lower() for kw in data_keywords):
+        if code and _DATA_CLASSIFIER.search(code.lower()):
             return 'data'
         
         # 5. 混合类：同时有代码和 UI 命令
@@ -343,50 +799,82 @@ class AIAgent:
         # 6. 默认：纯回答类
         return 'answer'
 
+    @staticmethod
+    def _compact_observations(messages: List[dict]) -> None:
+        """就地把较早的 Observation 替换为一行摘要，控制每步重发的 token 数
+        
+        前 3 条（系统提示词、数据上下文、问题）与最近的 Observation 保持原文；
+        已压缩的消息内容不再变化，压缩后的前缀仍可命中缓存。纯本地操作，不额外调用 LLM。
+        """
+        observations = [
+            msg for msg in messages[3:]
+            if msg['role'] == 'tool' or (msg['role'] == 'user' and msg['content'].startswith('Observation:'))
+        ]
+        for k, msg in enumerate(observations[:-KEEP_RECENT_OBSERVATIONS], start=1):
+            body = msg['content'] if msg['role'] == 'tool' else msg['content'][len('Observation: '):]
+            if body.startswith('obs_'):
+                continue
+            summary = f"obs_{k}: {body.split(chr(10), 1)[0][:80]} ({len(body)} chars)"
+            msg['content'] = summary if msg['role'] == 'tool' else f"Observation: {summary}"
+
+    def _is_step_complete(self, message: dict) -> bool:
+        """流式解析时判断本步是否已可执行，以便提前断开 LLM 流
+        
+        - tool calling：finish 调用的参数已是完整 JSON 时即可结束（其余并行调用排在它之前）
+        - 文本格式：已收到完整的 JSON 对象时结束，避免模型继续臆造 Observation
+        """
+        tool_calls = message.get('tool_calls')
+        if tool_calls:
+            last = tool_calls[-1]['function']
+            if last['name'] != 'finish' or not last['arguments'].rstrip().endswith('}'):
+                return False
+            try:
+                json.loads(last['arguments'])
+            except ValueError:
+                return False
+            return True
+        
+        content = message.get('content') or ''
+        if not content.rstrip().endswith('}'):
+            return False
+        return self._parse_react_response(content) is not None
+
+    @staticmethod
+    def _load_tool_arguments(arguments: Any) -> dict:
+        """解析 tool_call 的 arguments（JSON 字符串）"""
+        if isinstance(arguments, dict):
+            return arguments
+        try:
+            parsed = json.loads(arguments or '{}')
+        except (TypeError, ValueError):
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+
     def _parse_react_response(self, text: str) -> Optional[Dict]:
-        """解析 ReAct 格式响应"""
-        lines = text.split('\n')
-        action = None
-        action_input = None
-        
-        for line in lines:
-            line = line.strip()
-            if line.startswith('Action:'):
-                action = line[len('Action:'):].strip()
-            elif line.startswith('Action Input:'):
-                input_str = line[len('Action Input:'):].strip()
-                try:
-                    # 尝试修复常见的 JSON 格式错误 (如单引号)
-                    if input_str.startswith("'") and input_str.endswith("'"):
-                         input_str = input_str[1:-1]
-                    action_input = json.loads(input_str)
-                except:
-                    # 如果 json 跨行，需要更复杂的提取
-                    # 简单回退：尝试找整个文本中的 json 块
-                    pass
-        
-        # 如果简单解析失败，尝试全文正则
-        if not action or not action_input:
-            import re
-            act_match = re.search(r'Action:\s*(.*)', text)
-            if act_match:
-                action = act_match.group(1).strip()
-            
-            inp_match = re.search(r'Action Input:\s*(\{.*?\})', text, re.DOTALL)
-            if inp_match:
-                try:
-                    action_input = json.loads(inp_match.group(1))
-                except:
-                    pass
-        
-        if action and action_input is not None:
+        """解析未使用 tool calling 时的文本回复
+        
+        模型被要求输出单个 JSON 对象 {"thought": ..., "action": ..., "action_input": {...}}，
+        这里一次 orjson.loads 完成解析；不是合法 JSON 时视为直接回答。
+        """
+        text = text.strip()
+        if not text.startswith('{'):
+            return None
+        try:
+            parsed = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return None
+        
+        action = parsed.get('action') if isinstance(parsed, dict) else None
+        action_input = parsed.get('action_input', {})
+        if isinstance(action, str) and action and isinstance(action_input, dict):
             return {'action': action, 'action_input': action_input}
         return None
 
-    def generate_code(self, query: str) -> Dict[str, Any]:
+    async def generate_code(self, query: str,
+                            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """入口：使用 ReAct 循环生成代码"""
         # 接管原有的 generate_code
-        return self.run_react_loop(query)
+        return await self.run_react_loop(query, on_event)
 
     # 保留原有的辅助方法 (fallback_generate, etc.) 以防万一
     # ... (省略，但实际代码中需要保留)
@@ -405,9 +893,9 @@ class AIAgent:
     # ... (preview_query, confirm_and_execute, execute_query, find_semantic_mappings 保持不变)
     # 它们会调用新的 generate_code (即 run_react_loop)
     
-    def preview_query(self, query: str) -> Dict[str, Any]:
+    async def preview_query(self, query: str) -> Dict[str, Any]:
         # ... (保持原样，无需修改，因为 generate_code 接口签名没变)
-        generated = self.generate_code(query)
+        generated = await self.generate_code(query)
         self.pending_execution = {
             'query': query,
             'type': generated.get('type', 'data'),
@@ -426,7 +914,7 @@ class AIAgent:
             'execution_id': id(self.pending_execution)
         }
 
-    def confirm_and_execute(self) -> Dict[str, Any]:
+    async def confirm_and_execute(self) -> Dict[str, Any]:
         # ... (保持原样)
         if not self.pending_execution:
             return {'success': False, 'error': '没有待确认的操作'}
@@ -447,14 +935,14 @@ class AIAgent:
         # 这对于读操作没问题（多读一次），对于写操作也没问题（幂等或是我们期望的）。
         
         if cmd_type in ('data', 'mixed') and code:
-            from undo_manager import get_undo_manager
-            tables = self.engine.get_all_tables()
-            if tables:
-                get_undo_manager().create_snapshot(tables)
-            result = self.sandbox.execute(code, local_vars={}, db_connection=self.engine.conn)
+            # 只读代码无需快照；写操作只复制代码中引用到的表，而不是每次复制全部表
+            if not self.sandbox.is_read_only(code):
+                tables = _referenced_tables(code, self.engine.get_all_tables())
+                if tables:
+                    get_undo_manager().create_snapshot(tables)
+            result = await self._execute_code(code)
         
         if cmd_type in ('ui', 'mixed') and commands:
-            from ui_commands import get_ui_queue
             get_ui_queue().add_batch(commands)
             ui_result['commands_sent'] = len(commands)
             get_logger().add_log("UI_CMD", f"Queued {len(commands)} UI commands", details=commands)
@@ -469,9 +957,10 @@ class AIAgent:
             'success': result.get('success', True)
         }
 
-    def execute_query(self, query: str) -> Dict[str, Any]:
+    async def execute_query(self, query: str,
+                            on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """直接执行查询（跳过确认）"""
-        generated = self.generate_code(query)
+        generated = await self.generate_code(query, on_event)
         code = generated.get('code', '')
         
         # 处理空代码情况
@@ -488,7 +977,7 @@ class AIAgent:
                 'answer': generated.get('answer', generated.get('explanation', ''))
             }
         
-        result = self.sandbox.execute(code, local_vars={}, db_connection=self.engine.conn)
+        result = await self._execute_code(code)
         return {
             'query': query,
             'generated_code': code,
@@ -502,27 +991,24 @@ class AIAgent:
             'temp_table': generated.get('temp_table') # 🆕 传递 temp_table
         }
 
-    def find_semantic_mappings(self, table_a: str, table_b: str) -> Dict[str, Any]:
+    async def find_semantic_mappings(self, table_a: str, table_b: str) -> Dict[str, Any]:
         # ... (保持原样，或者也升级为 ReAct? 暂时保持原样以降低风险)
         if table_a not in self.engine.tables or table_b not in self.engine.tables:
             return {'error': '表不存在'}
-        info_a = self.engine.describe_table(table_a)
-        info_b = self.engine.describe_table(table_b)
-        
         if not self.llm_client:
              return self._fallback_mapping(table_a, table_b)
-             
+        
+        # 两张表的描述互不依赖，并发生成
+        info_a, info_b = await asyncio.gather(
+            asyncio.to_thread(self.engine.describe_table, table_a),
+            asyncio.to_thread(self.engine.describe_table, table_b)
+        )
         prompt = SEMANTIC_MAPPING_PROMPT.format(table_a_info=info_a, table_b_info=info_b)
         messages = [{"role": "system", "content": "你是一位数据分析专家。"}, {"role": "user", "content": prompt}]
         try:
-            response = self.llm_client.chat(messages, temperature=0.2)
-            if "```json" in response:
-                json_start = response.find("```json") + 7
-                json_end = response.find("```", json_start)
-                json_str = response[json_start:json_end].strip()
-            else:
-                json_str = response.strip()
-            result = json.loads(json_str)
+            response = await self.llm_client.chat(messages, temperature=0.2)
+            match = _JSON_BLOCK.search(response)
+            result = orjson.loads(match.group(1) if match else response.strip())
             result['llm_used'] = True
             return result
         except Exception as e:
@@ -538,25 +1024,50 @@ class AIAgent:
         info_b = self.engine.get_table_info(table_b)
         cols_a = info_a[table_a]['column_names']
         cols_b = info_b[table_b]['column_names']
-        mappings = []
-        for col_a in cols_a:
-            for col_b in cols_b:
-                if col_a.lower() == col_b.lower():
-                    mappings.append({'table_a_col': col_a, 'table_b_col': col_b, 'confidence': 1.0, 'reason': '名称完全匹配'})
+        # 按小写列名建索引，一次哈希求交代替两两比较
+        low_b = {col_b.lower(): col_b for col_b in cols_b}
+        mappings = [
+            {'table_a_col': col_a, 'table_b_col': low_b[col_a.lower()], 'confidence': 1.0, 'reason': '名称完全匹配'}
+            for col_a in cols_a
+            if col_a.lower() in low_b
+        ]
         return {'mappings': mappings, 'join_key_suggestion': None, 'llm_used': False}
 
 
 # 全局实例
-_agent_instance: Optional[AIAgent] = None
+# LLMClient 无会话状态，相同配置的所有会话共用一个（连接池保持预热）
+_llm_clients: Dict[tuple, LLMClient] = {}
+# 每个会话一个 AIAgent（待确认代码、会话历史、探查缓存互不干扰），按 LRU 淘汰
+DEFAULT_SESSION = 'default'
+MAX_AGENT_SESSIONS = 256
+_agents: "OrderedDict[str, AIAgent]" = OrderedDict()
+
+
+def _get_llm_client(api_base: str, api_key: str, model: str) -> LLMClient:
+    key = (api_base, api_key, model)
+    client = _llm_clients.get(key)
+    if client is None:
+        client = _llm_clients[key] = LLMClient(api_base, api_key, model)
+    return client
+
 
-def get_agent() -> AIAgent:
-    global _agent_instance
-    if _agent_instance is None:
-        _agent_instance = AIAgent()
-    return _agent_instance
+def get_agent(session_id: str = DEFAULT_SESSION) -> AIAgent:
+    agent = _agents.get(session_id)
+    if agent is None:
+        agent = _agents[session_id] = AIAgent()
+        if len(_agents) > MAX_AGENT_SESSIONS:
+            _agents.popitem(last=False)
+    else:
+        _agents.move_to_end(session_id)
+    return agent
 
 def reload_agent():
-    global _agent_instance
-    _agent_instance = AIAgent()
-    return _agent_instance
+    global _PROMPTS, SYSTEM_PROMPT, SEMANTIC_MAPPING_PROMPT
+    # 提示词文件未变化时 load_prompts 直接命中缓存
+    _PROMPTS = load_prompts()
+    SYSTEM_PROMPT = _PROMPTS.get('system_prompt', '')
+    SEMANTIC_MAPPING_PROMPT = _PROMPTS.get('semantic_mapping_prompt', '')
+    # 配置可能已变化：丢弃所有会话的代理，按需用新配置重建
+    _agents.clear()
+    return get_agent()
 
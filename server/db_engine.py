@@ -4,19 +4,115 @@ AI-Sheet-Pro DuckDB 数据引擎
 """
 
 import os
+import re
+import functools
+import threading
 import duckdb
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from python_calamine import CalamineWorkbook
+import xlsxwriter
+from collections import OrderedDict
 from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 
 
+# 表名中允许保留的字符之外的部分（替换为下划线）
+_IDENT_RE = re.compile(r'[^a-zA-Z0-9_\u4e00-\u9fff]')
+
+
+# 可缓存的查询：以只读关键字开头，且不含写操作或易变函数（结果随时间/随机数变化）
+_CACHEABLE_SQL_RE = re.compile(r'^\s*\(*\s*(select|with|from|values|table)\b', re.IGNORECASE)
+_UNCACHEABLE_SQL_RE = re.compile(
+    r'\b(insert|update|delete|create|drop|alter|replace|truncate|copy|attach|detach|export|import'
+    r'|install|load|pragma|set|checkpoint|vacuum|random|uuid|gen_random_uuid|now|current_date'
+    r'|current_time|current_timestamp|get_current_time|nextval|setseed)\b',
+    re.IGNORECASE
+)
+
+
+def quote_identifier(name: str) -> str:
+    """将表名/列名包裹为 SQL 双引号标识符（内部双引号转义）"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+@functools.lru_cache(maxsize=256)
+def sanitize_table_name(name: str) -> str:
+    """清理表名，确保符合 SQL 命名规范（同名表反复上传/检查，结果按名称缓存）"""
+    # 替换非法字符；确保不以数字开头
+    s = _IDENT_RE.sub('_', name)
+    return ('t_' + s if s[:1].isdigit() else s) or 'unnamed_table'
+
+
+def _whole_floats_to_int(array: pa.Array) -> pa.Array:
+    """calamine 把 Excel 中的数字一律读成浮点；整列都是整数时（编号、数量）转回 int64，与 pandas 读取的类型一致"""
+    if not pa.types.is_floating(array.type) or array.null_count == len(array):
+        return array
+    if not pc.all(pc.equal(pc.floor(array), array)).as_py():
+        return array
+    try:
+        return array.cast(pa.int64())
+    except pa.ArrowInvalid:
+        # 超出 int64 范围或含无穷大
+        return array
+
+
+def compact_arrow_table(table: pa.Table) -> pa.Table:
+    """将取值范围落在 int32 内的 int64 列收窄为 int32，减少后续扫描的内存带宽
+    
+    收窄会改变用户与 AI 写 SQL 时面对的列类型：int32 列相乘（数量 × 单价）或
+    UPDATE 写入更大的值都会溢出，因此导入路径默认不调用，只供调用方显式选用。
+    """
+    int32 = pa.int32()
+    lo, hi = -(2 ** 31), 2 ** 31 - 1
+    for i, field in enumerate(table.schema):
+        if field.type != pa.int64():
+            continue
+        bounds = pc.min_max(table.column(i)).as_py()
+        if bounds['min'] is None or (lo <= bounds['min'] and bounds['max'] <= hi):
+            table = table.set_column(i, pa.field(field.name, int32), table.column(i).cast(int32))
+    return table
+
+
+def decimals_to_float(table: pa.Table) -> pa.Table:
+    """将 DECIMAL 列转为 float64 再输出为 JSON
+    
+    SUM(整数列) 等聚合在 DuckDB 中得到 HUGEINT/DECIMAL，to_pylist 会产生 Decimal 对象，
+    序列化为字符串 "10"；转为浮点与原先 fetchdf 的结果（10.0）保持一致。
+    """
+    float64 = pa.float64()
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, pa.field(field.name, float64), table.column(i).cast(float64))
+    return table
+
+
 class DataEngine:
     """DuckDB 内存数据库引擎"""
     
     # 影子数据流阈值：超过此行数时启用分页
     SHADOW_THRESHOLD = 1000
+    # Excel 单个工作表的最大行数（含表头）
+    EXCEL_MAX_ROWS = 1_048_576
     # 默认视图窗口大小
     DEFAULT_VIEW_SIZE = 100
+    # 超过此行数的表探查列值时改为按样本取高频值（DISTINCT 需要对整列建哈希表）
+    INSPECT_SAMPLE_THRESHOLD = 1_000_000
+    # 只读查询结果缓存的总字节上限
+    RESULT_CACHE_BYTES = 128 * 1024 * 1024
+    # 热点查询的参数化 SQL 模板（标识符展开时加引号），按 (模板, 表, 列) 缓存展开结果
+    STATEMENTS = {
+        'view': 'SELECT * FROM {table} LIMIT ? OFFSET ?',
+        'view_keyset': 'SELECT rowid AS __rowid, * FROM {table} WHERE rowid > ? LIMIT ?',
+        'view_offset': 'SELECT rowid AS __rowid, * FROM {table} LIMIT ? OFFSET ?',
+        'sample': 'SELECT * FROM {table} LIMIT ?',
+        'distinct': 'SELECT DISTINCT {column} FROM {table} LIMIT ?',
+        # 大表探查：在固定大小的蓄水池样本上取出现最多的值，代价与表行数无关
+        'frequent': 'SELECT {column} FROM (SELECT {column} FROM {table} USING SAMPLE 100000 ROWS) '
+                    'GROUP BY 1 ORDER BY count(*) DESC LIMIT ?',
+        'count': 'SELECT count(*) FROM {table}',
+    }
     
     def __init__(self, temp_dir: str = None):
         """初始化数据引擎
@@ -26,6 +122,20 @@ class DataEngine:
         """
         self.conn = duckdb.connect(':memory:')
         self.tables: Dict[str, dict] = {}  # 表元信息 {name: {rows, columns, schema}}
+        # 元数据版本号：表的增删或行数变化时递增，供上层缓存（如 AI 上下文）判断失效
+        self.metadata_version = 0
+        # 顺序滚动的分页游标 {表名: (元数据版本, 下一页 offset, 已返回的最后 rowid)}
+        self._view_cursors: Dict[str, Tuple[int, int, int]] = {}
+        # 已展开的语句 {(模板, 表名, 列名): SQL}，表删除或重命名时失效
+        self._prepared: Dict[Tuple[str, str, Optional[str]], str] = {}
+        # 表描述文本缓存 {(表名, 行数): 描述}
+        self._describe_cache: Dict[Tuple[str, int], str] = {}
+        # 同一描述的 UTF-8 编码结果，供直接写入响应体的调用方使用
+        self._describe_bytes_cache: Dict[Tuple[str, int], bytes] = {}
+        # 只读查询结果缓存 {SQL: Arrow 表}，按 LRU 淘汰；元数据版本变化时整体清空
+        self._result_cache: 'OrderedDict[str, pa.Table]' = OrderedDict()
+        self._result_cache_bytes = 0
+        self._result_cache_version = 0
         
         # 设置临时目录
         if temp_dir:
@@ -33,13 +143,36 @@ class DataEngine:
         else:
             self.temp_dir = Path(__file__).parent / 'temp'
         self.temp_dir.mkdir(exist_ok=True)
+        self._configure_connection()
+    
+    def _configure_connection(self) -> None:
+        """设置 DuckDB 线程数、内存上限与溢写目录
+        
+        可通过环境变量 DUCKDB_THREADS / DUCKDB_MEMORY_LIMIT 覆盖。
+        内存上限之外的中间结果溢写到 temp/spill，避免大表聚合时直接 OOM。
+        """
+        spill_dir = self.temp_dir / 'spill'
+        spill_dir.mkdir(exist_ok=True)
+        threads = int(os.environ.get('DUCKDB_THREADS') or os.cpu_count() or 1)
+        memory_limit = os.environ.get('DUCKDB_MEMORY_LIMIT', '8GB').replace("'", '')
+        spill_path = str(spill_dir).replace("'", "''")
+        
+        self.conn.execute(f"SET threads = {threads}")
+        self.conn.execute(f"SET memory_limit = '{memory_limit}'")
+        self.conn.execute(f"SET temp_directory = '{spill_path}'")
+        # 重复扫描同一 Parquet/CSV 文件时命中内置缓存；旧版本 DuckDB 没有此选项
+        try:
+            self.conn.execute("SET enable_external_file_cache = true")
+        except duckdb.Error:
+            pass
     
-    def load_excel(self, file_path: str, table_name: str = None) -> dict:
+    def load_excel(self, file_path: str, table_name: str = None, sheet_name: str = None) -> dict:
         """加载 Excel 文件到内存表
         
         Args:
             file_path: Excel 文件路径
             table_name: 表名（可选，默认使用文件名）
+            sheet_name: 工作表名（可选，默认第一个工作表）
             
         Returns:
             加载结果信息
@@ -53,20 +186,60 @@ class DataEngine:
             table_name = self._sanitize_table_name(path.stem)
         
         # 读取 Excel
+        suffix = path.suffix.lower()
+        if suffix != '.xls':
+            # calamine (Rust) 一次读出整张表，直接构建 Arrow 表，不经过 pandas
+            try:
+                arrow_table = self._read_excel_arrow(file_path, sheet_name)
+                # 导入可能在工作线程中进行，使用独立游标
+                with self.conn.cursor() as cur:
+                    cur.execute(f'DROP TABLE IF EXISTS {quote_identifier(table_name)}')
+                    self._create_table_from(cur, table_name, arrow_table)
+                return self._register_table(table_name)
+            except Exception as e:
+                print(f"calamine 读取失败 ({str(e)}), 回退到 pandas...")
+        
+        sheet = sheet_name if sheet_name is not None else 0
         try:
             # 根据后缀选择引擎
-            suffix = path.suffix.lower()
             if suffix == '.xls':
-                df = pd.read_excel(file_path, engine='xlrd')
+                df = pd.read_excel(file_path, sheet_name=sheet, engine='xlrd')
             else:
-                df = pd.read_excel(file_path, engine='openpyxl')
+                df = pd.read_excel(file_path, sheet_name=sheet, engine='openpyxl')
         except Exception as e:
             print(f"Excel加载尝试失败 ({str(e)}), 正在重试默认引擎...")
             # 失败后尝试自动检测
-            df = pd.read_excel(file_path)
+            df = pd.read_excel(file_path, sheet_name=sheet)
             
         return self._register_dataframe(df, table_name)
     
+    def _read_excel_arrow(self, file_path: str, sheet_name: str = None) -> pa.Table:
+        """用 calamine 读取工作表，首行作为表头"""
+        workbook = CalamineWorkbook.from_path(file_path)
+        if sheet_name is None:
+            sheet = workbook.get_sheet_by_index(0)
+        else:
+            sheet = workbook.get_sheet_by_name(sheet_name)
+        rows = sheet.to_python(skip_empty_area=True)
+        if not rows:
+            raise ValueError("工作表为空")
+        
+        header, body = rows[0], rows[1:]
+        # 与 pandas 一致：空表头命名为 Unnamed: i，重复表头追加 .1、.2 后缀
+        names, seen = [], {}
+        for i, value in enumerate(header):
+            name = str(value) if value not in (None, '') else f"Unnamed: {i}"
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            names.append(name)
+        
+        # calamine 以空字符串表示空单元格，这里统一成 NULL；类型混杂的列 pa.array 会抛错，由调用方回退
+        columns = [[None if v == '' else v for v in col] for col in zip(*body)] if body else [[] for _ in names]
+        return pa.table({name: _whole_floats_to_int(pa.array(values)) for name, values in zip(names, columns)})
+    
     def load_csv(self, file_path: str, table_name: str = None, encoding: str = 'utf-8') -> dict:
         """加载 CSV 文件到内存表
         
@@ -85,6 +258,22 @@ class DataEngine:
         if not table_name:
             table_name = self._sanitize_table_name(path.stem)
         
+        # UTF-8 文件直接由 DuckDB 的多线程 CSV 读取器建表，不经过 pandas
+        if encoding.lower().replace('_', '-') in ('utf-8', 'utf8', 'utf-8-sig'):
+            literal = str(path).replace("'", "''")
+            try:
+                # 导入可能在工作线程中进行，使用独立游标
+                with self.conn.cursor() as cur:
+                    cur.execute(f'DROP TABLE IF EXISTS {quote_identifier(table_name)}')
+                    cur.execute(
+                        f'CREATE TABLE {quote_identifier(table_name)} AS '
+                        f"SELECT * FROM read_csv_auto('{literal}', sample_size=-1)"
+                    )
+                return self._register_table(table_name)
+            except duckdb.Error as e:
+                # 多半是 GBK 等非 UTF-8 编码，回退到 pandas 逐个尝试编码
+                print(f"DuckDB 读取 CSV 失败 ({str(e)}), 回退到 pandas...")
+        
         # 尝试多种编码
         for enc in [encoding, 'utf-8', 'gbk', 'gb2312', 'utf-8-sig']:
             try:
@@ -97,48 +286,93 @@ class DataEngine:
         
         return self._register_dataframe(df, table_name)
     
-    def load_dataframe(self, df: pd.DataFrame, table_name: str) -> dict:
-        """直接加载 DataFrame 到内存表"""
+    def load_dataframe(self, df: pd.DataFrame, table_name: str, compact: bool = False) -> dict:
+        """直接加载 DataFrame 到内存表
+        
+        Args:
+            compact: 是否把 int64 列收窄为 int32（会改变列类型，算术可能溢出，默认不收窄）
+        """
         table_name = self._sanitize_table_name(table_name)
-        return self._register_dataframe(df, table_name)
+        return self._register_dataframe(df, table_name, compact)
     
-    def _register_dataframe(self, df: pd.DataFrame, table_name: str) -> dict:
+    @staticmethod
+    def _create_table_from(cur, table_name: str, data) -> None:
+        """以 Arrow 表或 DataFrame 创建 DuckDB 表（表名经 quote_identifier 引用，数字开头或保留字也可用）"""
+        temp_view = f"_temp_view_{table_name}"
+        cur.register(temp_view, data)
+        try:
+            cur.execute(f'CREATE TABLE {quote_identifier(table_name)} AS SELECT * FROM {quote_identifier(temp_view)}')
+        finally:
+            # 清理临时视图
+            cur.unregister(temp_view)
+    
+    def _register_dataframe(self, df: pd.DataFrame, table_name: str, compact: bool = False) -> dict:
         """将 DataFrame 注册为 DuckDB 表"""
         # 确保表名唯一且安全
         # 注册表 (使用 CREATE TABLE AS 真正创建表，而不是 View，以便支持 UPDATE/DELETE)
-        # 先注册个临时视图
-        temp_view = f"_temp_view_{table_name}"
-        self.conn.register(temp_view, df)
-        
-        # 然后创建实体表
-        self.conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-        self.conn.execute(f'CREATE TABLE "{table_name}" AS SELECT * FROM "{temp_view}"')
+        try:
+            # 先转成 Arrow 表，DuckDB 直接从 Arrow 列缓冲区建表
+            arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+            if compact:
+                arrow_table = compact_arrow_table(arrow_table)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 混合类型的 object 列（Excel 中常见）Arrow 无法推断，交给 DuckDB 自己扫描 pandas
+            arrow_table = None
         
-        # 清理临时视图
-        self.conn.unregister(temp_view)
+        # 导入可能在工作线程中进行，使用独立游标（临时视图只在该游标内可见）
+        with self.conn.cursor() as cur:
+            cur.execute(f'DROP TABLE IF EXISTS {quote_identifier(table_name)}')
+            self._create_table_from(cur, table_name, arrow_table if arrow_table is not None else df)
         
-        # 获取表信息
-        row_count = len(df)
-        col_count = len(df.columns)
-        schema = {col: str(dtype) for col, dtype in df.dtypes.items()}
+        # 元信息统一从 DESCRIBE 读取：无论经哪条路径导入（以及撤回、重命名后），
+        # AI 看到的都是 DuckDB 类型名（VARCHAR、BIGINT），而不是 Arrow/pandas 类型名
+        return self._register_table(table_name)
+    
+    def _register_table(self, table_name: str) -> dict:
+        """为已在 DuckDB 中建好的表记录元信息（从 DESCRIBE 与 count(*) 读取）"""
+        with self.conn.cursor() as cur:
+            columns = cur.execute(f'DESCRIBE {quote_identifier(table_name)}').fetchall()
+            row_count = cur.execute(self._statement('count', table_name)).fetchone()[0]
+        schema = {col[0]: col[1] for col in columns}
         
-        # 记录元信息
         self.tables[table_name] = {
             'rows': row_count,
-            'columns': col_count,
+            'columns': len(schema),
             'schema': schema,
-            'column_names': list(df.columns),
+            'column_names': list(schema),
             'use_shadow': row_count > self.SHADOW_THRESHOLD
         }
+        self.invalidate_statements(table_name)
+        self.metadata_version += 1
         
         return {
             'table_name': table_name,
             'rows': row_count,
-            'columns': col_count,
+            'columns': len(schema),
             'use_shadow': row_count > self.SHADOW_THRESHOLD,
             'schema': schema
         }
     
+    def _statement(self, kind: str, table_name: str, column_name: str = None) -> str:
+        """取热点查询的 SQL 文本；同一模式下 SQL 文本不变，只绑定参数"""
+        key = (kind, table_name, column_name)
+        sql = self._prepared.get(key)
+        if sql is None:
+            sql = self._prepared[key] = self.STATEMENTS[kind].format(
+                table=quote_identifier(table_name), column=quote_identifier(column_name)
+            )
+        return sql
+    
+    def invalidate_statements(self, table_name: str) -> None:
+        """表被删除、重建或重命名后清理与之相关的语句、描述与分页游标"""
+        for key in [key for key in self._prepared if key[1] == table_name]:
+            del self._prepared[key]
+        for key in [key for key in self._describe_cache if key[0] == table_name]:
+            del self._describe_cache[key]
+        for key in [key for key in self._describe_bytes_cache if key[0] == table_name]:
+            del self._describe_bytes_cache[key]
+        self._view_cursors.pop(table_name, None)
+    
     def execute_sql(self, sql: str) -> Tuple[List[dict], List[str]]:
         """执行 SQL 查询
         
@@ -148,22 +382,69 @@ class DataEngine:
         Returns:
             (数据行列表, 列名列表)
         """
+        table = decimals_to_float(self.execute_sql_arrow(sql))
+        return table.to_pylist(), table.column_names
+    
+    def execute_sql_arrow(self, sql: str) -> pa.Table:
+        """执行 SQL 查询，直接返回 Arrow 表（列式缓冲区，不经过 pandas）
+        
+        只读查询的结果按 SQL 文本缓存，数据未变化时重复查询（滚动、预览后确认）直接复用；
+        其余语句执行后视为数据已修改，清空缓存。
+        """
+        cacheable = bool(_CACHEABLE_SQL_RE.match(sql)) and not _UNCACHEABLE_SQL_RE.search(sql)
+        if cacheable:
+            if self._result_cache_version != self.metadata_version:
+                self._clear_result_cache()
+            cached = self._result_cache.get(sql)
+            if cached is not None:
+                self._result_cache.move_to_end(sql)
+                return cached
+        
         try:
-            result = self.conn.execute(sql)
-            df = result.fetchdf()
-            columns = list(df.columns)
-            data = df.to_dict(orient='records')
-            return data, columns
+            table = self.conn.execute(sql).fetch_arrow_table()
         except Exception as e:
             raise RuntimeError(f"SQL 执行失败: {str(e)}")
+        
+        if cacheable:
+            self._cache_result(sql, table)
+        else:
+            self.mark_modified()
+        return table
+    
+    def mark_modified(self) -> None:
+        """绕过 DataEngine 写入数据后调用（如沙箱中执行的 UPDATE），使依赖数据的缓存失效"""
+        self.metadata_version += 1
+        self._clear_result_cache()
+        # 表描述含样本行，DML 后可能过期（行数不变时按 (table, rows) 的键仍会命中）
+        self._describe_cache.clear()
+        self._describe_bytes_cache.clear()
+    
+    def _cache_result(self, sql: str, table: pa.Table) -> None:
+        """放入结果缓存，总字节数超出上限时淘汰最久未用的结果"""
+        size = table.nbytes
+        if size > self.RESULT_CACHE_BYTES // 4:
+            # 单个结果过大，缓存它会挤掉其余所有条目
+            return
+        self._result_cache[sql] = table
+        self._result_cache_bytes += size
+        while self._result_cache_bytes > self.RESULT_CACHE_BYTES:
+            _, evicted = self._result_cache.popitem(last=False)
+            self._result_cache_bytes -= evicted.nbytes
     
-    def get_view_window(self, table_name: str, offset: int = 0, limit: int = None) -> dict:
+    def _clear_result_cache(self) -> None:
+        self._result_cache.clear()
+        self._result_cache_bytes = 0
+        self._result_cache_version = self.metadata_version
+    
+    def get_view_window(self, table_name: str, offset: int = 0, limit: int = None,
+                        as_arrow: bool = False) -> dict:
         """获取表格分页视图窗口
         
         Args:
             table_name: 表名
             offset: 起始行偏移
             limit: 返回行数
+            as_arrow: 为 True 时 data 为 Arrow 表，不转换为 Python 对象
             
         Returns:
             视图数据
@@ -175,9 +456,32 @@ class DataEngine:
             limit = self.DEFAULT_VIEW_SIZE
         
         table_info = self.tables[table_name]
-        sql = f"SELECT * FROM {table_name} LIMIT {limit} OFFSET {offset}"
         
-        data, columns = self.execute_sql(sql)
+        # 顺序向下滚动时按 rowid 续读（keyset 分页），每页只扫描 limit 行；
+        # 随机跳页才退回 OFFSET（需要扫描并丢弃前 offset 行）。
+        # DuckDB 默认保持插入顺序，无 ORDER BY 时结果按 rowid 递增返回
+        # 用户表自带 rowid 列时会遮蔽内置 rowid，只能用 OFFSET
+        cursor = self._view_cursors.get(table_name)
+        has_own_rowid = any(str(col).lower() == 'rowid' for col in table_info['column_names'])
+        if has_own_rowid:
+            sql, params = self._statement('view', table_name), [limit, offset]
+        elif cursor and cursor[0] == self.metadata_version and cursor[1] == offset:
+            sql = self._statement('view_keyset', table_name)
+            params = [cursor[2], limit]
+        else:
+            sql = self._statement('view_offset', table_name)
+            params = [limit, offset]
+        
+        try:
+            table = self.conn.execute(sql, params).fetch_arrow_table()
+        except Exception as e:
+            raise RuntimeError(f"SQL 执行失败: {str(e)}")
+        
+        if not has_own_rowid:
+            if table.num_rows:
+                last_rowid = table.column('__rowid')[-1].as_py()
+                self._view_cursors[table_name] = (self.metadata_version, offset + table.num_rows, last_rowid)
+            table = table.drop(['__rowid'])
         
         return {
             'table_name': table_name,
@@ -185,8 +489,8 @@ class DataEngine:
             'total_columns': table_info['columns'],
             'offset': offset,
             'limit': limit,
-            'data': data,
-            'columns': columns,
+            'data': table if as_arrow else table.to_pylist(),
+            'columns': table.column_names,
             'has_more': offset + limit < table_info['rows']
         }
     
@@ -203,97 +507,177 @@ class DataEngine:
         return list(self.tables.keys())
     
     def drop_table(self, table_name: str) -> bool:
-        """删除表"""
-        if table_name in self.tables:
-            self.conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-            del self.tables[table_name]
-            return True
-            return True
-        return False
+        """删除表或视图
+        
+        以 DuckDB 的 information_schema 为准（AI 生成的临时表可能不在 self.tables 中），
+        返回是否确实删除了对象。
+        """
+        res = self.conn.execute(
+            "SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+            [table_name]
+        ).fetchone()
+        if res:
+            kind = 'VIEW' if res[0] == 'VIEW' else 'TABLE'
+            self.conn.execute(f'DROP {kind} IF EXISTS {quote_identifier(table_name)}')
+        
+        known = self.tables.pop(table_name, None) is not None
+        if not (res or known):
+            return False
+        self.invalidate_statements(table_name)
+        self.metadata_version += 1
+        return True
 
     def refresh_metadata(self) -> None:
         """强制刷新所有表的元数据（主要是行数）"""
-        for table_name in list(self.tables.keys()):
-            try:
-                # 获取最新行数
-                res = self.conn.execute(f'SELECT count(*) FROM "{table_name}"').fetchone()
-                if res:
-                    self.tables[table_name]['rows'] = res[0]
-            except Exception as e:
-                print(f"Error refreshing metadata for {table_name}: {e}")
+        table_names = list(self.tables.keys())
+        if not table_names:
+            return
+        
+        # 所有表的行数合并为一条 UNION ALL 查询
+        sql = " UNION ALL ".join(
+            f"SELECT {i} AS i, count(*) FROM {quote_identifier(name)}"
+            for i, name in enumerate(table_names)
+        )
+        try:
+            counts = {table_names[i]: n for i, n in self.conn.execute(sql).fetchall()}
+        except Exception:
+            # 有表已在 DuckDB 中被删除（如 AI 代码直接 DROP），逐表查询以定位
+            counts = {}
+            for table_name in table_names:
+                try:
+                    counts[table_name] = self.conn.execute(self._statement('count', table_name)).fetchone()[0]
+                except Exception as e:
+                    print(f"Error refreshing metadata for {table_name}: {e}")
+        
+        for table_name, rows in counts.items():
+            if rows != self.tables[table_name]['rows']:
+                self._describe_cache.pop((table_name, self.tables[table_name]['rows']), None)
+                self._describe_bytes_cache.pop((table_name, self.tables[table_name]['rows']), None)
+                self.tables[table_name]['rows'] = rows
+                self.metadata_version += 1
     
     def _sanitize_table_name(self, name: str) -> str:
         """清理表名，确保符合 SQL 命名规范"""
-        # 替换非法字符
-        import re
-        clean_name = re.sub(r'[^a-zA-Z0-9_\u4e00-\u9fff]', '_', name)
-        # 确保不以数字开头
-        if clean_name and clean_name[0].isdigit():
-            clean_name = 't_' + clean_name
-        return clean_name or 'unnamed_table'
+        return sanitize_table_name(name)
     
     def get_sample_data(self, table_name: str, n: int = 5) -> List[dict]:
         """获取表的样本数据"""
-        sql = f"SELECT * FROM {table_name} LIMIT {n}"
-        data, _ = self.execute_sql(sql)
-        return data
+        # 使用独立游标，describe_table 可以在工作线程中并发调用
+        with self.conn.cursor() as cur:
+            return cur.execute(self._statement('sample', table_name), [n]).fetch_arrow_table().to_pylist()
     
 
     def describe_table(self, table_name: str) -> str:
-        """生成表的描述文本（用于 AI 上下文）"""
+        """生成表的描述文本（用于 AI 上下文）
+        
+        按 (表名, 行数) 缓存；表重新导入、删除或改名时清除。
+        """
         if table_name not in self.tables:
             raise ValueError(f"表不存在: {table_name}")
         
         info = self.tables[table_name]
-        desc = f"表名: {table_name}\n"
-        desc += f"行数: {info['rows']}, 列数: {info['columns']}\n"
-        desc += "列信息:\n"
-        for col, dtype in info['schema'].items():
-            desc += f"  - {col}: {dtype}\n"
+        key = (table_name, info['rows'])
+        cached = self._describe_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        parts = [
+            f"表名: {table_name}\n",
+            f"行数: {info['rows']}, 列数: {info['columns']}\n",
+            "列信息:\n",
+        ]
+        parts.extend(f"  - {col}: {dtype}\n" for col, dtype in info['schema'].items())
         
         # 添加样本数据
         sample = self.get_sample_data(table_name, 3)
         if sample:
-            desc += "\n前3行样本:\n"
-            for i, row in enumerate(sample):
-                desc += f"  {i+1}: {row}\n"
+            parts.append("\n前3行样本:\n")
+            parts.extend(f"  {i+1}: {row}\n" for i, row in enumerate(sample))
         
+        desc = "".join(parts)
+        self._describe_cache[key] = desc
         return desc
     
-    def inspect_column(self, table_name: str, column_name: str, n: int = 10) -> List[Any]:
-        """探查某列的唯一值（用于 AI 确认枚举值）"""
+    def describe_table_bytes(self, table_name: str) -> bytes:
+        """describe_table 的 UTF-8 编码结果，缓存方式相同，重复调用不再重新编码"""
         if table_name not in self.tables:
             raise ValueError(f"表不存在: {table_name}")
-            
-        # 安全检查列名
-        clean_col = self._sanitize_table_name(column_name)
+        
+        key = (table_name, self.tables[table_name]['rows'])
+        cached = self._describe_bytes_cache.get(key)
+        if cached is None:
+            cached = self._describe_bytes_cache[key] = self.describe_table(table_name).encode('utf-8')
+        return cached
+    
+    def _resolve_column(self, table_name: str, column_name: str) -> str:
+        """校验表和列存在，返回真实列名（列名不区分大小写匹配）"""
+        if table_name not in self.tables:
+            raise ValueError(f"表不存在: {table_name}")
+        
         # 注意：这里不能简单 sanitize，因为列名可能包含非 ASCII 字符，但 DuckDB 支持双引号包裹
         # 我们假设调用方传入的 column_name 是合法的或已经在 AI 上下文中存在
-        
-        # 1. 检查列是否存在
         info = self.tables[table_name]
-        if column_name not in info['schema']:
-            # 尝试不区分大小写查找
-            found = False
-            for real_col in info['schema']:
-                if real_col.lower() == column_name.lower():
-                    column_name = real_col
-                    found = True
-                    break
-            if not found:
-                raise ValueError(f"表 {table_name} 中不存在列 {column_name}")
+        if column_name in info['schema']:
+            return column_name
+        # 尝试不区分大小写查找
+        for real_col in info['schema']:
+            if real_col.lower() == column_name.lower():
+                return real_col
+        raise ValueError(f"表 {table_name} 中不存在列 {column_name}")
+    
+    def _inspect_kind(self, table_name: str) -> str:
+        """按表行数选择列值探查语句：小表精确 DISTINCT，大表按样本取高频值"""
+        return 'frequent' if self.tables[table_name]['rows'] > self.INSPECT_SAMPLE_THRESHOLD else 'distinct'
+    
+    def inspect_column(self, table_name: str, column_name: str, n: int = 10) -> List[Any]:
+        """探查某列的唯一值（用于 AI 确认枚举值）"""
+        # 1. 检查列是否存在
+        column_name = self._resolve_column(table_name, column_name)
 
         try:
             # 2. 查询 Distinct 值
-            # 限制数据量，防止对超大表进行全表扫描（虽然 DuckDB 很快，但还是防御一下）
-            # 如果行数 > 50000，先采样？DuckDB 的 DISTINCT 优化很好，直接查通常没问题。
+            # 超大表上 DISTINCT 要对整列建哈希表，改为在样本上取前 n 个高频值，
+            # 对 AI 确认枚举值（"上海" 还是 "上海市"）反而更有用
             
-            sql = f'SELECT DISTINCT "{column_name}" FROM "{table_name}" LIMIT {n}'
-            res = self.conn.execute(sql).fetchall()
+            sql = self._statement(self._inspect_kind(table_name), table_name, column_name)
+            # 使用独立游标，允许 AI 代理在工作线程中（推测）调用
+            with self.conn.cursor() as cur:
+                res = cur.execute(sql, [n]).fetchall()
             return [r[0] for r in res]
         except Exception as e:
             raise RuntimeError(f"探查列失败: {str(e)}")
 
+    def inspect_columns(self, specs: List[Tuple[str, str, int]]) -> Dict[Tuple[str, str, int], List[Any]]:
+        """批量探查多列的唯一值，所有列合并为一条查询
+        
+        Args:
+            specs: [(table_name, column_name, n), ...]
+            
+        Returns:
+            {(table_name, column_name, n): [唯一值, ...]}，键使用调用方传入的参数
+        """
+        if not specs:
+            return {}
+        
+        # 每列聚合为一个 LIST 标量子查询，各列保持原生类型（与 inspect_column 的结果一致），
+        # 不必为 UNION 统一转成 VARCHAR
+        subqueries = []
+        params = []
+        for table_name, column_name, n in specs:
+            real_col = self._resolve_column(table_name, column_name)
+            inner = self._statement(self._inspect_kind(table_name), table_name, real_col)
+            subqueries.append(f'(SELECT list(v) FROM ({inner}) AS sub(v))')
+            params.append(int(n))
+        sql = "SELECT " + ", ".join(subqueries)
+        
+        try:
+            with self.conn.cursor() as cur:
+                row = cur.execute(sql, params).fetchone()
+        except Exception as e:
+            raise RuntimeError(f"探查列失败: {str(e)}")
+        
+        # 空列的 list() 聚合结果为 NULL
+        return {spec: values or [] for spec, values in zip(specs, row)}
 
 
     def export_table_as_excel(self, table_name: str, output_path: str) -> str:
@@ -308,24 +692,79 @@ class DataEngine:
         """
         if table_name not in self.tables:
             raise ValueError(f"表不存在: {table_name}")
+        
+        # 超出工作表行数上限时 xlsxwriter 只返回 -1 而不报错，文件会被静默截断，必须先检查
+        with self.conn.cursor() as cur:
+            row_count = cur.execute(self._statement('count', table_name)).fetchone()[0]
+        if row_count + 1 > self.EXCEL_MAX_ROWS:
+            raise ValueError(
+                f"表 {table_name} 共 {row_count} 行，超出 Excel 单个工作表上限 {self.EXCEL_MAX_ROWS - 1} 行，"
+                f"请改用 format=parquet 或 format=feather 导出"
+            )
             
-        # SQL 查询全量数据
-        sql = f"SELECT * FROM {table_name}"
-        result = self.conn.execute(sql)
-        df = result.fetchdf()
+        # 按批读取 Arrow 数据并逐行写入，constant_memory 模式下写完的行立即落盘，
+        # 内存占用只与批大小有关，不随表行数增长
+        cur = self.conn.cursor()
+        reader = cur.execute(f'SELECT * FROM {quote_identifier(table_name)}').fetch_record_batch(8192)
+        workbook = xlsxwriter.Workbook(output_path, {
+            'constant_memory': True,
+            'strings_to_urls': False,
+            'nan_inf_to_errors': True,
+            'remove_timezone': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        })
+        try:
+            worksheet = workbook.add_worksheet()
+            worksheet.write_row(0, 0, reader.schema.names)
+            row_idx = 1
+            for batch in reader:
+                for row in zip(*(column.to_pylist() for column in batch.columns)):
+                    worksheet.write_row(row_idx, 0, row)
+                    row_idx += 1
+        finally:
+            workbook.close()
+            cur.close()
+        return output_path
+    
+    def export_table_as_parquet(self, table_name: str, output_path: str) -> str:
+        """将表导出为 Parquet 文件（DuckDB 直接写出，zstd 压缩）"""
+        if table_name not in self.tables:
+            raise ValueError(f"表不存在: {table_name}")
         
-        # 导出为 Excel
-        df.to_excel(output_path, index=False, engine='openpyxl')
+        path_literal = "'" + str(output_path).replace("'", "''") + "'"
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"COPY (SELECT * FROM {quote_identifier(table_name)}) "
+                f"TO {path_literal} (FORMAT PARQUET, COMPRESSION 'zstd')"
+            )
+        return output_path
+    
+    def export_table_as_feather(self, table_name: str, output_path: str) -> str:
+        """将表导出为 Feather (Arrow IPC 文件)，按批写出，内存占用与表行数无关"""
+        if table_name not in self.tables:
+            raise ValueError(f"表不存在: {table_name}")
+        
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with self.conn.cursor() as cur:
+            reader = cur.execute(f'SELECT * FROM {quote_identifier(table_name)}').fetch_record_batch(8192)
+            with pa.ipc.new_file(output_path, reader.schema, options=options) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
         return output_path
 
 # 全局单例
 _engine_instance: Optional[DataEngine] = None
-
+_engine_lock = threading.Lock()
 
 
 def get_engine() -> DataEngine:
-    """获取全局数据引擎实例"""
+    """获取全局数据引擎实例
+    
+    线程池中的并发首个请求可能同时进入，加锁保证只创建一个 DuckDB 连接。
+    """
     global _engine_instance
     if _engine_instance is None:
-        _engine_instance = DataEngine()
+        with _engine_lock:
+            if _engine_instance is None:
+                _engine_instance = DataEngine()
     return _engine_instance
@@ -1,14 +1,22 @@
 
 import time
-import uuid
+import itertools
+import threading
+from collections import deque
 from typing import List, Dict, Any, Optional
 
 class LogManager:
     """In-memory log manager for system monitoring."""
     
     def __init__(self, max_logs: int = 1000):
-        self._logs: List[Dict[str, Any]] = []
+        # Ring buffer: the oldest entry drops off automatically when full
+        self._logs: deque = deque(maxlen=max_logs)
         self._max_logs = max_logs
+        # Monotonically increasing ids, so entries newer than a given id are
+        # always a suffix of the buffer
+        self._ids = itertools.count(1)
+        # Sandbox code logs from worker threads while the API reads on the event loop
+        self._lock = threading.Lock()
 
     def add_log(self, type: str, content: str, details: Any = None) -> None:
         """Add a new log entry.
@@ -19,49 +27,52 @@ class LogManager:
             details: Detailed object (JSON or string)
         """
         entry = {
-            'id': str(uuid.uuid4()),
+            'id': None,
             'timestamp': time.time(),
             'type': type,
             'content': content,
             'details': details
         }
-        self._logs.append(entry)
-        
-        # Keep size limit
-        if len(self._logs) > self._max_logs:
-            self._logs = self._logs[-self._max_logs:]
+        # Only id assignment and the append need to be atomic (ids must stay in
+        # buffer order); everything else is built outside the lock
+        with self._lock:
+            entry['id'] = str(next(self._ids))
+            self._logs.append(entry)
             
     def get_logs(self, since_id: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Get logs since a specific ID."""
-        if not since_id:
-            return self._logs
-            
-        # Find index of since_id
-        start_idx = -1
-        for i, log in enumerate(self._logs):
-            if log['id'] == since_id:
-                start_idx = i
-                break
+        """Get logs since a specific ID.
         
-        if start_idx != -1:
-            return self._logs[start_idx + 1:]
+        If the ID is unknown (rotated out, or from before a restart) the client
+        is out of sync, so all logs are returned to let it resync.
+        """
+        try:
+            since = int(since_id) if since_id else None
+        except ValueError:
+            since = None
         
-        # If ID not found (maybe cleared), return all or empty? 
-        # Strategy: if ID provided but not found, assume client is out of sync or logs rotated.
-        # Ideally return all to resync, or assume they are new. 
-        # For simplicity, if id not found, return empty to avoid duplicates if client has old ID, 
-        # unless it's way old. 
-        # Better strategy for simple polling: just return all if not found might duplicate.
-        # Let's return only if we find the anchor, otherwise return all (client reset)?
-        # Safe approach: return all logs if since_id not found only if it was requested.
-        # Actually, simpler: client sends last known ID. If found, send subsequent. If not found (rotated out), send all.
-        return self._logs
+        with self._lock:
+            if since is None or not self._logs \
+                    or not int(self._logs[0]['id']) <= since <= int(self._logs[-1]['id']):
+                return list(self._logs)
+            
+            # Walk back from the newest entry; cost is proportional to the number of new logs
+            newer = []
+            for log in reversed(self._logs):
+                if int(log['id']) <= since:
+                    break
+                newer.append(log)
+        newer.reverse()
+        return newer
 
 # Global instance
 _logger_instance: Optional[LogManager] = None
+_logger_lock = threading.Lock()
 
 def get_logger() -> LogManager:
     global _logger_instance
     if _logger_instance is None:
-        _logger_instance = LogManager()
+        # Double-checked so concurrent first calls cannot create two buffers
+        with _logger_lock:
+            if _logger_instance is None:
+                _logger_instance = LogManager()
     return _logger_instance
@@ -5,16 +5,22 @@ FastAPI + DuckDB + AI 代理（增强版）
 
 import os
 import shutil
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Any, Optional, List
 import tempfile
+import pyarrow as pa
+import orjson
 
-from db_engine import get_engine, DataEngine
-from ai_agent import get_agent, reload_agent, AIAgent
+from db_engine import get_engine, DataEngine, quote_identifier, decimals_to_float, sanitize_table_name
+from ai_agent import get_agent, reload_agent, AIAgent, DEFAULT_SESSION
 from sandbox import get_sandbox
 from logger import get_logger
 
@@ -22,7 +28,9 @@ from logger import get_logger
 app = FastAPI(
     title="AI-Sheet-Pro Backend",
     description="AI 驱动的表格处理服务",
-    version="2.1.0"
+    version="2.1.0",
+    # orjson 在 C 层序列化，大量行数据的接口（视图、SQL 查询）明显更快
+    default_response_class=ORJSONResponse
 )
 
 # CORS 配置
@@ -38,6 +46,44 @@ app.add_middleware(
 TEMP_DIR = Path(__file__).parent / 'temp'
 TEMP_DIR.mkdir(exist_ok=True)
 
+# 文件解析与导入在专用线程池中进行，不阻塞事件循环；
+# 限制并发数，避免多个上传同时抢占 DuckDB 自身的线程池
+INGEST_WORKERS = 2
+_ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+
+
+def _spool_upload(file: UploadFile, temp_path: Path) -> None:
+    """按块把上传内容拷贝到临时文件，内存占用与文件大小无关"""
+    file.file.seek(0)
+    with open(temp_path, 'wb') as f:
+        shutil.copyfileobj(file.file, f, 1 << 20)
+
+
+def _upload_table_name(filename: str) -> str:
+    """未指定表名时，上传文件导入后的表名（由文件名去掉扩展名得到）"""
+    return sanitize_table_name(Path(filename).stem)
+
+
+async def _ingest_upload(file: UploadFile, table_name: Optional[str], sheet_name: Optional[str] = None) -> dict:
+    """保存上传文件并导入为表（均在导入线程池中执行）"""
+    engine = get_engine()
+    loop = asyncio.get_running_loop()
+    # 每次上传落盘到独立的临时文件，并发上传同名文件不会互相覆盖；
+    # 临时文件名是随机的，表名须按原文件名确定
+    table_name = table_name or _upload_table_name(file.filename)
+    suffix = Path(file.filename).suffix.lower()
+    fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=TEMP_DIR)
+    os.close(fd)
+    try:
+        await loop.run_in_executor(_ingest_executor, _spool_upload, file, Path(temp_path))
+        
+        if suffix == '.csv':
+            return await loop.run_in_executor(_ingest_executor, engine.load_csv, temp_path, table_name)
+        return await loop.run_in_executor(_ingest_executor, engine.load_excel, temp_path, table_name, sheet_name)
+    finally:
+        # 数据已导入 DuckDB 表，临时文件不再需要
+        os.unlink(temp_path)
+
 
 # =============== 日志 API ===============
 
@@ -89,12 +135,31 @@ class QueryRequest(BaseModel):
 
 class SQLRequest(BaseModel):
     sql: str
+    format: str = 'json'  # 'json' | 'arrow' | 'soa'
 
 
 class ViewRequest(BaseModel):
     table_name: str
     offset: int = 0
     limit: int = 100
+    format: str = 'json'  # 'json' | 'arrow' | 'soa'
+
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def arrow_response(table: pa.Table, headers: dict = None) -> Response:
+    """以 Arrow IPC 流格式返回查询结果，客户端可零拷贝读取"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(content=sink.getvalue().to_pybytes(), media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+
+
+def columnar_data(table: pa.Table) -> dict:
+    """按列组织的数据 {列名: [值, ...]}（format=soa），列名不再在每一行里重复"""
+    table = decimals_to_float(table)
+    return {name: column.to_pylist() for name, column in zip(table.column_names, table.columns)}
 
 
 class SemanticMappingRequest(BaseModel):
@@ -102,6 +167,12 @@ class SemanticMappingRequest(BaseModel):
     table_b: str
 
 
+@app.on_event("startup")
+def warm_up_engine():
+    """启动时创建数据引擎，避免首个请求承担连接与线程池初始化开销"""
+    get_engine()
+
+
 # =============== 基础 API ===============
 
 @app.get("/api/health")
@@ -133,7 +204,8 @@ async def list_tables():
 @app.post("/api/upload", response_model=APIResponse)
 async def upload_file(
     file: UploadFile = File(...),
-    table_name: Optional[str] = Form(None)
+    table_name: Optional[str] = Form(None),
+    sheet_name: Optional[str] = Form(None)
 ):
     """上传文件并指定表名"""
     engine = get_engine()
@@ -143,15 +215,7 @@ async def upload_file(
         if not (filename.endswith('.xlsx') or filename.endswith('.xls') or filename.endswith('.csv')):
             return APIResponse(success=False, message="仅支持 Excel (.xlsx, .xls) 和 CSV 文件")
         
-        temp_path = TEMP_DIR / file.filename
-        with open(temp_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
-        
-        if filename.endswith('.csv'):
-            result = engine.load_csv(str(temp_path), table_name)
-        else:
-            result = engine.load_excel(str(temp_path), table_name)
+        result = await _ingest_upload(file, table_name, sheet_name)
         
         use_shadow = result['rows'] > engine.SHADOW_THRESHOLD
         
@@ -165,59 +229,75 @@ async def upload_file(
         return APIResponse(success=False, message=f"上传失败: {str(e)}")
 
 
-@app.post("/api/upload/table-a", response_model=APIResponse)
-async def upload_table_a(file: UploadFile = File(...)):
-    """专用：导入 A 表"""
+@app.post("/api/upload_batch", response_model=APIResponse)
+async def upload_files(files: List[UploadFile] = File(...)):
+    """一次请求上传多个文件，并发导入，每个文件以文件名作为表名"""
     engine = get_engine()
-    
-    try:
-        filename = file.filename.lower()
-        temp_path = TEMP_DIR / file.filename
-        with open(temp_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
-        
-        if filename.endswith('.csv'):
-            result = engine.load_csv(str(temp_path), 'table_a')
-        else:
-            result = engine.load_excel(str(temp_path), 'table_a')
-        
-        return APIResponse(success=True, message=f"A 表导入成功，共 {result['rows']} 行", data=result)
-    except Exception as e:
-        return APIResponse(success=False, message=f"A 表导入失败: {str(e)}")
 
+    for file in files:
+        if not file.filename.lower().endswith(('.xlsx', '.xls', '.csv')):
+            return APIResponse(success=False, message=f"仅支持 Excel (.xlsx, .xls) 和 CSV 文件: {file.filename}")
 
-@app.post("/api/upload/table-b", response_model=APIResponse)
-async def upload_table_b(file: UploadFile = File(...)):
-    """专用：导入 B 表"""
-    engine = get_engine()
-    
-    try:
-        filename = file.filename.lower()
-        temp_path = TEMP_DIR / file.filename
-        with open(temp_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
-        
-        if filename.endswith('.csv'):
-            result = engine.load_csv(str(temp_path), 'table_b')
+    # 表名由文件名决定，同名（或仅扩展名不同，如 a.csv 与 a.xlsx）的文件并发导入会争用同一张表
+    table_names = [_upload_table_name(file.filename) for file in files]
+    duplicates = sorted({name for name in table_names if table_names.count(name) > 1})
+    if duplicates:
+        return APIResponse(success=False, message=f"多个文件对应同一表名: {'、'.join(duplicates)}")
+
+    # 各文件在导入线程池中并行落盘和导入，单个失败不影响其他文件
+    outcomes = await asyncio.gather(
+        *(_ingest_upload(file, None) for file in files),
+        return_exceptions=True
+    )
+
+    results = []
+    failed = []
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, Exception):
+            failed.append(f"{file.filename}: {outcome}")
+            results.append({'filename': file.filename, 'success': False, 'error': str(outcome)})
         else:
-            result = engine.load_excel(str(temp_path), 'table_b')
-        
-        return APIResponse(success=True, message=f"B 表导入成功，共 {result['rows']} 行", data=result)
-    except Exception as e:
-        return APIResponse(success=False, message=f"B 表导入失败: {str(e)}")
+            results.append({
+                'filename': file.filename,
+                'success': True,
+                **outcome,
+                'use_shadow_mode': outcome['rows'] > engine.SHADOW_THRESHOLD
+            })
+
+    if failed:
+        return APIResponse(success=False, message="部分文件上传失败: " + "; ".join(failed), data=results)
+    return APIResponse(
+        success=True,
+        message=f"已加载 {len(results)} 个文件：" + "、".join(r['table_name'] for r in results),
+        data=results
+    )
+
+
+def _fixed_table_upload(table_name: str, label: str):
+    """生成导入到固定表名的上传接口（A/B 表对比场景）"""
+    async def upload(file: UploadFile = File(...)):
+        try:
+            result = await _ingest_upload(file, table_name)
+            return APIResponse(success=True, message=f"{label}导入成功，共 {result['rows']} 行", data=result)
+        except Exception as e:
+            return APIResponse(success=False, message=f"{label}导入失败: {str(e)}")
+    upload.__name__ = f"upload_{table_name}"
+    return upload
+
+
+app.post("/api/upload/table-a", response_model=APIResponse)(_fixed_table_upload('table_a', 'A 表'))
+app.post("/api/upload/table-b", response_model=APIResponse)(_fixed_table_upload('table_b', 'B 表'))
 
 
 # =============== 语义映射 API ===============
 
 @app.post("/api/semantic/mapping", response_model=APIResponse)
-async def find_semantic_mapping(request: SemanticMappingRequest):
+async def find_semantic_mapping(request: SemanticMappingRequest, x_session_id: str = Header(DEFAULT_SESSION)):
     """识别两个表之间的语义映射（同义异名列）"""
-    agent = get_agent()
+    agent = get_agent(x_session_id)
     
     try:
-        result = agent.find_semantic_mappings(request.table_a, request.table_b)
+        result = await agent.find_semantic_mappings(request.table_a, request.table_b)
         
         if 'error' in result:
             return APIResponse(success=False, message=result['error'])
@@ -232,17 +312,17 @@ async def find_semantic_mapping(request: SemanticMappingRequest):
 
 
 @app.get("/api/semantic/auto-detect", response_model=APIResponse)
-async def auto_detect_mapping():
+async def auto_detect_mapping(x_session_id: str = Header(DEFAULT_SESSION)):
     """自动检测已加载表的语义映射"""
     engine = get_engine()
-    agent = get_agent()
+    agent = get_agent(x_session_id)
     
     tables = engine.get_all_tables()
     if len(tables) < 2:
         return APIResponse(success=False, message="需要至少两个表才能进行语义映射")
     
     # 使用前两个表
-    result = agent.find_semantic_mappings(tables[0], tables[1])
+    result = await agent.find_semantic_mappings(tables[0], tables[1])
     return APIResponse(
         success=True,
         message=f"自动检测 {tables[0]} 和 {tables[1]} 的映射",
@@ -254,39 +334,12 @@ async def auto_detect_mapping():
 
 @app.delete("/api/table/{table_name}", response_model=APIResponse)
 async def delete_table(table_name: str):
-    """删除指定表格"""
+    """删除指定表格（或视图）"""
     engine = get_engine()
     
     try:
-        # 1. 检查是否存在（内存字典）
-        if table_name not in engine.tables:
-            # 尝试从数据库直接检查，防止字典不同步
-            pass 
-        
-        # 2. 从 DuckDB 获取对象类型 (BASE TABLE 或 VIEW)
-        # DuckDB 的 information_schema 是标准的
-        res = engine.conn.execute(
-            "SELECT table_type FROM information_schema.tables WHERE table_name = ?", 
-            [table_name]
-        ).fetchone()
-        
-        if res:
-            table_type = res[0] # 'BASE TABLE' or 'VIEW'
-            if table_type == 'VIEW':
-                engine.conn.execute(f'DROP VIEW IF EXISTS "{table_name}"')
-            else:
-                engine.conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-        else:
-            # 如果元数据里没有，尝试盲删（防御性）
-            try:
-                engine.conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-            except:
-                engine.conn.execute(f'DROP VIEW IF EXISTS "{table_name}"')
-
-        # 3. 从内部字典删除
-        if table_name in engine.tables:
-            del engine.tables[table_name]
-        
+        if not engine.drop_table(table_name):
+            return APIResponse(success=False, message=f"表 {table_name} 不存在")
         return APIResponse(
             success=True,
             message=f"表 '{table_name}' 已删除",
@@ -300,32 +353,37 @@ async def delete_table(table_name: str):
 
 # =============== 导出表格 API ===============
 
+# 导出格式 -> (扩展名, MIME 类型, DataEngine 导出方法名)
+EXPORT_FORMATS = {
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'export_table_as_excel'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet', 'export_table_as_parquet'),
+    'feather': ('.feather', 'application/vnd.apache.arrow.file', 'export_table_as_feather'),
+}
+
+
 @app.get("/api/export/{table_name}")
-async def export_table(table_name: str):
-    """导出表格为 Excel 文件"""
+async def export_table(table_name: str, format: str = Query('xlsx')):
+    """导出表格为文件（xlsx / parquet / feather）"""
     engine = get_engine()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+    suffix, media_type, method = EXPORT_FORMATS[format]
     
+    # 每次导出使用独立临时文件，发送完毕后删除
+    fd, output_path = tempfile.mkstemp(suffix=suffix, dir=TEMP_DIR)
+    os.close(fd)
     try:
-        # 创建临时文件
-        temp_dir = Path(tempfile.gettempdir())
-        output_filename = f"{table_name}_export.xlsx"
-        output_path = temp_dir / output_filename
-        
-        # 导出
-        engine.export_table_as_excel(table_name, str(output_path))
-        
-        # 返回文件
-        return FileResponse(
-            path=output_path, 
-            filename=output_filename,
-            media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
+        await asyncio.to_thread(getattr(engine, method), table_name, output_path)
     except Exception as e:
+        os.unlink(output_path)
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return FileResponse(
+        path=output_path,
+        filename=f"{table_name}_export{suffix}",
+        media_type=media_type,
+        background=BackgroundTask(os.unlink, output_path)
+    )
 
 
 # =============== 撤回 API ===============
@@ -347,15 +405,15 @@ async def undo_last_operation():
 # =============== AI 查询 API（带预览确认） ===============
 
 @app.post("/api/ai/preview", response_model=APIResponse)
-async def ai_preview(request: QueryRequest):
+async def ai_preview(request: QueryRequest, x_session_id: str = Header(DEFAULT_SESSION)):
     """AI 查询预览（不执行，返回待确认信息）"""
-    agent = get_agent()
+    agent = get_agent(x_session_id)
     
     try:
         if not request.query.strip():
             return APIResponse(success=False, message="查询内容为空")
         
-        result = agent.preview_query(request.query)
+        result = await agent.preview_query(request.query)
         
         return APIResponse(
             success=True,
@@ -373,12 +431,12 @@ async def ai_preview(request: QueryRequest):
 
 
 @app.post("/api/ai/confirm", response_model=APIResponse)
-async def ai_confirm():
+async def ai_confirm(x_session_id: str = Header(DEFAULT_SESSION)):
     """确认并执行预览的 AI 操作"""
-    agent = get_agent()
+    agent = get_agent(x_session_id)
     
     try:
-        result = agent.confirm_and_execute()
+        result = await agent.confirm_and_execute()
         
         if result['success']:
             return APIResponse(
@@ -401,42 +459,77 @@ async def ai_confirm():
         return APIResponse(success=False, message=f"确认执行失败: {str(e)}")
 
 
+def query_response(result: dict) -> APIResponse:
+    """把 execute_query 的结果整理为 /api/ai/query 的响应"""
+    if not result['success']:
+        return APIResponse(
+            success=False,
+            message=f"执行失败: {result['execution_result'].get('error', '未知错误')}"
+        )
+    return APIResponse(
+        success=True,
+        message="查询成功",
+        data={
+            'query': result['query'],
+            'generated_code': result['generated_code'],
+            'explanation': result.get('explanation', ''),
+            'result': result['execution_result']['result'],
+            'llm_used': result.get('llm_used', False),
+            # 🆕 新增字段：AI 响应分类
+            'response_type': result.get('response_type', 'answer'),
+            'answer': result.get('answer', result.get('explanation', '')),
+            'temp_table': result.get('temp_table') # 🆕 传递 temp_table
+        }
+    )
+
+
 @app.post("/api/ai/query", response_model=APIResponse)
-async def ai_query(request: QueryRequest):
+async def ai_query(request: QueryRequest, x_session_id: str = Header(DEFAULT_SESSION)):
     """直接执行 AI 查询（跳过确认）"""
-    agent = get_agent()
+    agent = get_agent(x_session_id)
     
     try:
         if not request.query.strip():
             return APIResponse(success=False, message="查询内容为空")
         
-        result = agent.execute_query(request.query)
-        
-        if result['success']:
-            return APIResponse(
-                success=True,
-                message="查询成功",
-                data={
-                    'query': result['query'],
-                    'generated_code': result['generated_code'],
-                    'explanation': result.get('explanation', ''),
-                    'result': result['execution_result']['result'],
-                    'llm_used': result.get('llm_used', False),
-                    # 🆕 新增字段：AI 响应分类
-                    'response_type': result.get('response_type', 'answer'),
-                    'answer': result.get('answer', result.get('explanation', '')),
-                    'temp_table': result.get('temp_table') # 🆕 传递 temp_table
-                }
-            )
-        else:
-            return APIResponse(
-                success=False,
-                message=f"执行失败: {result['execution_result'].get('error', '未知错误')}"
-            )
+        return query_response(await agent.execute_query(request.query))
     except Exception as e:
         return APIResponse(success=False, message=f"AI 查询失败: {str(e)}")
 
 
+def sse_event(event: str, data: Any) -> bytes:
+    """编码一条 Server-Sent Events 消息"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, default=str) + b"\n\n"
+
+
+@app.post("/api/ai/query/stream")
+async def ai_query_stream(request: QueryRequest, x_session_id: str = Header(DEFAULT_SESSION)):
+    """流式执行 AI 查询（SSE）
+    
+    ReAct 每一步的 thought / action / observation 产生时立即推送，
+    最后推送一条 result 事件，内容与 /api/ai/query 的响应相同。
+    """
+    if not request.query.strip():
+        return APIResponse(success=False, message="查询内容为空")
+    
+    agent = get_agent(x_session_id)
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(agent.execute_query(request.query, on_event=events.put_nowait))
+    # 任务结束（无论成功与否）时放入 None 作为结束标记
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    
+    async def stream():
+        while (event := await events.get()) is not None:
+            yield sse_event(event['event'], event)
+        try:
+            response = query_response(task.result())
+        except Exception as e:
+            response = APIResponse(success=False, message=f"AI 查询失败: {str(e)}")
+        yield sse_event('result', jsonable_encoder(response))
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={'Cache-Control': 'no-cache'})
+
+
 # =============== 数据视图 API ===============
 
 @app.post("/api/data/view", response_model=APIResponse)
@@ -445,23 +538,54 @@ async def get_data_view(request: ViewRequest):
     engine = get_engine()
     
     try:
+        if request.format == 'arrow':
+            view_data = engine.get_view_window(request.table_name, request.offset, request.limit, as_arrow=True)
+            return arrow_response(view_data['data'], headers={
+                'X-Total-Rows': str(view_data['total_rows']),
+                'X-Has-More': str(view_data['has_more']).lower()
+            })
+        if request.format == 'soa':
+            view_data = engine.get_view_window(request.table_name, request.offset, request.limit, as_arrow=True)
+            table = view_data.pop('data')
+            view_data['data_soa'] = columnar_data(table)
+            return APIResponse(success=True, message=f"获取 {table.num_rows} 行", data=view_data)
         view_data = engine.get_view_window(request.table_name, request.offset, request.limit)
         return APIResponse(success=True, message=f"获取 {len(view_data['data'])} 行", data=view_data)
     except Exception as e:
         return APIResponse(success=False, message=f"获取失败: {str(e)}")
 
 
+def stream_table_ndjson(engine: DataEngine, table_name: str, batch_size: int = 4096):
+    """按记录批逐行输出 NDJSON：首行为 {"columns": [...]}，之后每行是一批数据行的数组"""
+    with engine.conn.cursor() as cur:
+        reader = cur.execute(f"SELECT * FROM {quote_identifier(table_name)}").fetch_record_batch(batch_size)
+        yield orjson.dumps({'columns': reader.schema.names}) + b"\n"
+        for batch in reader:
+            yield orjson.dumps(batch.to_pylist()) + b"\n"
+
+
 @app.get("/api/data/full/{table_name}", response_model=APIResponse)
-async def get_full_data(table_name: str):
-    """获取完整表数据"""
+async def get_full_data(table_name: str, format: str = Query('json')):
+    """获取完整表数据
+    
+    format=ndjson 时流式返回（不受行数上限限制，服务端内存与表大小无关）；
+    json / soa（按列组织）格式一次性返回，仅限 SHADOW_THRESHOLD 行以内的表。
+    """
     engine = get_engine()
     
     try:
         info = engine.get_table_info(table_name)
+        if format == 'ndjson':
+            # 同步生成器由 Starlette 放到线程池中迭代，不阻塞事件循环
+            return StreamingResponse(stream_table_ndjson(engine, table_name), media_type='application/x-ndjson')
+        
         if info[table_name]['rows'] > engine.SHADOW_THRESHOLD:
-            return APIResponse(success=False, message=f"数据量超过 {engine.SHADOW_THRESHOLD} 行")
+            return APIResponse(success=False, message=f"数据量超过 {engine.SHADOW_THRESHOLD} 行，请使用 format=ndjson 流式获取")
         
-        data, columns = engine.execute_sql(f"SELECT * FROM {table_name}")
+        if format == 'soa':
+            table = engine.execute_sql_arrow(f"SELECT * FROM {quote_identifier(table_name)}")
+            return APIResponse(success=True, message="获取成功", data={'data_soa': columnar_data(table), 'columns': table.column_names})
+        data, columns = engine.execute_sql(f"SELECT * FROM {quote_identifier(table_name)}")
         return APIResponse(success=True, message="获取成功", data={'data': data, 'columns': columns})
     except Exception as e:
         return APIResponse(success=False, message=f"获取失败: {str(e)}")
@@ -473,6 +597,11 @@ async def execute_sql(request: SQLRequest):
     engine = get_engine()
     
     try:
+        if request.format == 'arrow':
+            return arrow_response(engine.execute_sql_arrow(request.sql))
+        if request.format == 'soa':
+            table = engine.execute_sql_arrow(request.sql)
+            return APIResponse(success=True, message=f"返回 {table.num_rows} 行", data={'data_soa': columnar_data(table), 'columns': table.column_names})
         data, columns = engine.execute_sql(request.sql)
         return APIResponse(success=True, message=f"返回 {len(data)} 行", data={'data': data, 'columns': columns})
     except Exception as e:
@@ -481,14 +610,6 @@ async def execute_sql(request: SQLRequest):
 
 # =============== 表管理 API ===============
 
-@app.delete("/api/table/{table_name}", response_model=APIResponse)
-async def delete_table(table_name: str):
-    engine = get_engine()
-    if engine.drop_table(table_name):
-        return APIResponse(success=True, message=f"表 {table_name} 已删除")
-    return APIResponse(success=False, message=f"表 {table_name} 不存在")
-
-
 @app.get("/api/table/{table_name}/info", response_model=APIResponse)
 async def get_table_info(table_name: str):
     engine = get_engine()
@@ -500,6 +621,16 @@ async def get_table_info(table_name: str):
         return APIResponse(success=False, message=str(e))
 
 
+@app.get("/api/table/{table_name}/describe")
+async def describe_table(table_name: str):
+    """以纯文本返回表描述（与 AI 上下文中的内容一致）"""
+    engine = get_engine()
+    try:
+        return Response(content=engine.describe_table_bytes(table_name), media_type="text/plain; charset=utf-8")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 # =============== 配置 API ===============
 
 @app.post("/api/config/reload", response_model=APIResponse)
@@ -520,16 +651,19 @@ class TableOpRequest(BaseModel):
 async def rename_table(request: TableOpRequest):
     """重命名表格 (用于另存为)"""
     try:
-        engine = get_db_engine()
-        # 简单防 SQL 注入检查
+        engine = get_engine()
+        # 简单防 SQL 注入检查（标识符另外加引号）
         if not request.target_name.isidentifier():
              return APIResponse(success=False, message="表名不合法")
              
-        engine.conn.execute(f"ALTER TABLE {request.source_table} RENAME TO {request.target_name}")
+        engine.conn.execute(
+            f"ALTER TABLE {quote_identifier(request.source_table)} RENAME TO {quote_identifier(request.target_name)}"
+        )
         # 更新元数据
         if request.source_table in engine.tables:
              del engine.tables[request.source_table]
-        engine.tables[request.target_name] = {'rows': 0, 'columns': []} # 下次 refresh 会更新
+        engine.invalidate_statements(request.source_table)
+        engine._register_table(request.target_name)
         
         return APIResponse(success=True, message=f"已保存为 {request.target_name}")
     except Exception as e:
@@ -539,16 +673,19 @@ async def rename_table(request: TableOpRequest):
 async def overwrite_table(request: TableOpRequest):
     """覆盖表格 (Drop Old -> Rename New)"""
     try:
-        engine = get_db_engine()
+        engine = get_engine()
+        source, target = quote_identifier(request.source_table), quote_identifier(request.target_name)
         # 1. 删除旧表
-        engine.conn.execute(f"DROP TABLE IF EXISTS {request.target_name}")
+        engine.conn.execute(f"DROP TABLE IF EXISTS {target}")
         # 2. 重命名新表
-        engine.conn.execute(f"ALTER TABLE {request.source_table} RENAME TO {request.target_name}")
+        engine.conn.execute(f"ALTER TABLE {source} RENAME TO {target}")
         
         # 更新表格列表
         if request.source_table in engine.tables:
             del engine.tables[request.source_table]
-        # target_name 将在下次 refresh 时更新
+        engine.invalidate_statements(request.source_table)
+        engine.invalidate_statements(request.target_name)
+        engine._register_table(request.target_name)
         
         return APIResponse(success=True, message=f"已覆盖表格 {request.target_name}")
     except Exception as e:
@@ -4,6 +4,15 @@ AI-Sheet-Pro 安全沙箱
 """
 
 import os
+import re
+import ast
+import builtins
+import hashlib
+import reprlib
+import threading
+import time
+from collections import OrderedDict, deque
+from types import CodeType
 import sys
 import tempfile
 from pathlib import Path
@@ -13,6 +22,22 @@ import traceback
 from logger import get_logger
 
 
+# 变量摘要使用有界 repr：大对象只生成前 100 个字符，不会先完整 str() 再截断
+_REPR = reprlib.Repr()
+_REPR.maxstring = 100
+_REPR.maxother = 100
+_REPR.maxlist = _REPR.maxtuple = _REPR.maxdict = _REPR.maxset = 4
+
+
+def _summarize_value(value: Any) -> str:
+    """生成变量的简短摘要；DataFrame/Series/ndarray 只报告形状（和 dtype）"""
+    shape = getattr(value, 'shape', None)
+    if isinstance(shape, tuple):
+        dtype = getattr(value, 'dtype', None)
+        return f"<{type(value).__name__} {shape}{f' {dtype}' if dtype is not None else ''}>"
+    return _REPR.repr(value)[:100]
+
+
 class SandboxError(Exception):
     """沙箱执行错误"""
     pass
@@ -34,9 +59,52 @@ class CodeSandbox:
     ALLOWED_MODULES = {
         'pandas', 'numpy', 'duckdb', 'math', 'statistics',
         'datetime', 'json', 're', 'collections', 'itertools',
-        'functools', 'operator', 'decimal', 'fractions',
+        'decimal', 'fractions',
     }
     
+    # 可能修改数据或外部状态的 SQL 关键字 / DuckDB 关系 API 与 pandas 的写出方法
+    # （Python 的 import 语句不算写操作，只匹配 DuckDB 的 IMPORT DATABASE）
+    WRITE_PATTERN = re.compile(
+        r'\b(insert|update|delete|create|drop|alter|replace|truncate|copy|attach|detach'
+        r'|export|install|load|pragma|set|checkpoint|vacuum)\b'
+        r'|\bimport\s+database\b'
+        r'|\.(register|unregister|insert_into|to_table|to_view|create_view|create_table'
+        r'|write_csv|write_parquet|to_csv|to_excel|to_parquet|to_json|to_sql)\s*\(',
+        re.IGNORECASE
+    )
+    
+    # 禁止引用的名称（直接调用或赋值给变量后调用都不允许）：
+    # 动态执行、绕过属性检查的反射函数，以及可取回真实内置模块的 __builtins__
+    BLOCKED_NAMES = frozenset({
+        'eval', 'exec', 'compile', '__import__', '__builtins__',
+        'getattr', 'setattr', 'delattr', 'globals', 'locals', 'vars',
+    })
+    # 禁止访问的属性：经由其他模块取到 os/sys 等模块，或危险的系统调用
+    BLOCKED_ATTRIBUTES = frozenset({
+        'os', 'sys', 'shutil', 'subprocess', 'socket', 'builtins', 'system', 'popen', 'rmtree',
+        # 以字符串取属性/调方法，可绕过下面的双下划线属性检查
+        'attrgetter', 'methodcaller', 'partial',
+    })
+    # 允许访问的双下划线属性（其余如 __class__、__globals__ 可用于逃逸沙箱）
+    ALLOWED_DUNDERS = frozenset({'__name__', '__doc__'})
+    # 沙箱内可用的内置函数（异常类型另行全部放行）；
+    # exec 只在 globals 缺少 __builtins__ 时注入真实内置模块，因此必须显式给出受限版本
+    ALLOWED_BUILTINS = frozenset({
+        'abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytearray', 'bytes', 'callable', 'chr',
+        'complex', 'dict', 'divmod', 'enumerate', 'filter', 'float', 'format', 'frozenset',
+        'hash', 'hex', 'int', 'isinstance', 'issubclass', 'iter', 'len', 'list', 'map', 'max',
+        'min', 'next', 'object', 'oct', 'ord', 'pow', 'print', 'range', 'repr', 'reversed',
+        'round', 'set', 'slice', 'sorted', 'str', 'sum', 'tuple', 'type', 'zip',
+        'True', 'False', 'None', 'NotImplemented', 'Ellipsis',
+        # class 语句依赖
+        '__build_class__',
+    })
+    
+    # 已编译代码缓存的容量
+    CODE_CACHE_MAX = 128
+    # 保留的执行记录条数
+    HISTORY_MAX = 50
+    
     def __init__(self, temp_dir: str = None, max_memory_mb: int = 512):
         """初始化沙箱
         
@@ -51,7 +119,15 @@ class CodeSandbox:
         
         self.temp_dir.mkdir(exist_ok=True)
         self.max_memory_mb = max_memory_mb
-        self.execution_history = []
+        # 最近的执行记录（只保存摘要，不持有结果对象，旧记录自动丢弃）
+        self.execution_history = deque(maxlen=self.HISTORY_MAX)
+        # 通过校验的代码 -> 编译结果（LRU）；多个工作线程会并发执行，访问时加锁
+        self._code_cache: 'OrderedDict[bytes, CodeType]' = OrderedDict()
+        self._code_cache_lock = threading.Lock()
+        # 不随调用变化的全局变量只构建一次，每次执行浅拷贝后注入 db
+        self._base_globals = self._build_base_globals()
+        self._df_cls = self._base_globals['pd'].DataFrame
+        self._logger = get_logger()
     
     def validate_code(self, code: str) -> tuple[bool, str]:
         """验证代码安全性
@@ -62,39 +138,78 @@ class CodeSandbox:
         Returns:
             (是否安全, 错误信息)
         """
-        # 检查危险关键字
-        dangerous_patterns = [
-            'import os',
-            'from os import',
-            'import subprocess',
-            'from subprocess',
-            'import socket',
-            'from socket',
-            '__import__',
-            'eval(',
-            'exec(',
-            'compile(',
-            'open(',  # 需要在沙箱内重新定义
-            'os.system',
-            'os.popen',
-            'os.remove',
-            'os.unlink',
-            'shutil.rmtree',
-            'sys.exit',
-        ]
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            # 语法错误交给 exec 报告（带完整堆栈并写入日志）
+            return True, ""
+        error_msg = self._check_tree(tree, code)
+        return not error_msg, error_msg
+    
+    def _check_tree(self, tree: ast.AST, code: str) -> str:
+        """遍历语法树检查危险操作，返回错误信息（安全时为空串）
         
-        code_lower = code.lower()
-        for pattern in dangerous_patterns:
-            if pattern.lower() in code_lower:
-                # 特殊处理：允许 pandas/duckdb 的安全 open 操作
-                if pattern == 'open(' and ('pd.read' in code or 'duckdb' in code):
-                    continue
-                return False, f"检测到危险代码模式: {pattern}"
+        基于语法树判断，字符串字面量（如 x = "import os"）不会被误判。
+        """
+        blocked_names = self.BLOCKED_NAMES
+        # 特殊处理：允许 pandas/duckdb 的安全 open 操作
+        if not ('pd.read' in code or 'duckdb' in code):
+            blocked_names = blocked_names | {'open'}
         
-        return True, ""
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                modules = [node.module or '']
+            elif isinstance(node, ast.Name):
+                if node.id in blocked_names:
+                    return f"检测到危险代码模式: {node.id}"
+                continue
+            elif isinstance(node, ast.Constant):
+                # 含双下划线的字符串可交给反射工具访问 __globals__ 等属性
+                if isinstance(node.value, str) and '__' in node.value:
+                    return f"检测到危险代码模式: 字符串 {node.value!r}"
+                continue
+            elif isinstance(node, ast.Attribute):
+                attr = node.attr
+                if attr in self.BLOCKED_ATTRIBUTES or (
+                        attr.startswith('__') and attr.endswith('__') and attr not in self.ALLOWED_DUNDERS):
+                    return f"检测到危险代码模式: .{attr}"
+                continue
+            else:
+                continue
+            for module in modules:
+                if module.split('.')[0] not in self.ALLOWED_MODULES:
+                    return f"不允许导入模块: {module}"
+        return ""
+    
+    def _cached_code(self, key: bytes) -> Optional[CodeType]:
+        """取已校验并编译过的代码对象"""
+        with self._code_cache_lock:
+            compiled = self._code_cache.get(key)
+            if compiled is not None:
+                self._code_cache.move_to_end(key)
+            return compiled
+    
+    def _cache_code(self, key: bytes, compiled: CodeType) -> None:
+        with self._code_cache_lock:
+            self._code_cache[key] = compiled
+            if len(self._code_cache) > self.CODE_CACHE_MAX:
+                self._code_cache.popitem(last=False)
+    
+    def is_read_only(self, code: str) -> bool:
+        """粗略判断代码是否只读（宁可误判为写操作，也不漏判）"""
+        return not self.WRITE_PATTERN.search(code)
     
     def create_safe_globals(self, db_connection=None) -> dict:
         """创建安全的全局变量环境"""
+        safe_globals = self._base_globals.copy()
+        # 数据库连接（如果提供）
+        safe_globals['db'] = db_connection
+        return safe_globals
+    
+    def _build_base_globals(self) -> dict:
+        """构建沙箱的静态全局变量（库、内置函数、安全 open）"""
         import pandas as pd
         import numpy as np
         import duckdb
@@ -105,13 +220,37 @@ class CodeSandbox:
         from collections import Counter, defaultdict
         
         # 安全的文件操作（仅限 temp 目录）
+        # 按路径组成部分判断包含关系（字符串前缀会让 temp_evil/x 通过 temp 的检查）
+        temp_dir = self.temp_dir.resolve()
+        
         def safe_open(path, mode='r', *args, **kwargs):
             abs_path = Path(path).resolve()
-            if not str(abs_path).startswith(str(self.temp_dir)):
+            if not abs_path.is_relative_to(temp_dir):
                 raise SandboxError(f"文件操作被拒绝：只能访问 {self.temp_dir} 目录")
             return open(abs_path, mode, *args, **kwargs)
         
+        # import 语句经由 __builtins__['__import__'] 执行，只放行白名单模块
+        allowed_modules = self.ALLOWED_MODULES
+        
+        def safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level != 0 or name.split('.')[0] not in allowed_modules:
+                raise ImportError(f"不允许导入模块: {name}")
+            return builtins.__import__(name, globals, locals, fromlist, level)
+        
+        restricted_builtins = {
+            name: value for name, value in vars(builtins).items()
+            if name in self.ALLOWED_BUILTINS
+            or (isinstance(value, type) and issubclass(value, BaseException))
+        }
+        restricted_builtins['__import__'] = safe_import
+        restricted_builtins['open'] = safe_open
+        
         safe_globals = {
+            # 受限的内置命名空间（不给出时 exec 会注入真实的 builtins 模块）
+            '__builtins__': restricted_builtins,
+            # class 语句用它设置 __module__
+            '__name__': '__sandbox__',
+            
             # 数据处理库
             'pd': pd,
             'pandas': pd,
@@ -166,9 +305,6 @@ class CodeSandbox:
             
             # 打印（用于调试）
             'print': print,
-            
-            # 数据库连接（如果提供）
-            'db': db_connection,
         }
         
         return safe_globals
@@ -184,14 +320,23 @@ class CodeSandbox:
         Returns:
             执行结果字典
         """
-        # 验证代码安全性
-        is_safe, error_msg = self.validate_code(code)
-        if not is_safe:
-            return {
-                'success': False,
-                'error': error_msg,
-                'result': None
-            }
+        # 验证代码安全性（缓存中的代码已经通过校验，AI 重复提交相同代码时跳过校验与编译）
+        key = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        compiled = self._cached_code(key)
+        tree = None
+        if compiled is None:
+            try:
+                tree = ast.parse(code, '<sandbox>')
+            except SyntaxError:
+                # 语法错误交给下方执行路径报告（带完整堆栈并写入日志）
+                pass
+            error_msg = self._check_tree(tree, code) if tree is not None else ""
+            if error_msg:
+                return {
+                    'success': False,
+                    'error': error_msg,
+                    'result': None
+                }
         
         # 创建安全环境
         safe_globals = self.create_safe_globals(db_connection)
@@ -199,47 +344,51 @@ class CodeSandbox:
         
         # 记录执行历史
         execution_record = {
-            'code': code,
-            'timestamp': str(Path(__file__)),
+            'code': code[:500],
+            'timestamp': time.time(),
         }
         
         try:
             # 执行代码
-            exec(code, safe_globals, local_namespace)
+            if compiled is None:
+                # 直接编译校验时得到的语法树，不再重新解析源码
+                compiled = compile(tree if tree is not None else code, '<sandbox>', 'exec')
+                self._cache_code(key, compiled)
+            exec(compiled, safe_globals, local_namespace)
             
             # 获取结果（约定：结果存储在 'result' 变量中）
             result = local_namespace.get('result', None)
             
-            # 如果结果是 DataFrame，转换为可序列化格式
-            import pandas as pd
-            if isinstance(result, pd.DataFrame):
+            # 如果结果是 DataFrame，转换为按列组织的可序列化格式
+            # （每列一个列表，不为每行创建 dict，也不在每行重复列名）
+            if isinstance(result, self._df_cls):
                 result = {
                     'type': 'dataframe',
-                    'data': result.to_dict(orient='records'),
+                    'data_soa': {str(k): v for k, v in result.to_dict(orient='list').items()},
                     'columns': list(result.columns),
                     'shape': result.shape
                 }
             
             execution_record['success'] = True
-            execution_record['result'] = result
+            execution_record['result_shape'] = result['shape'] if isinstance(result, dict) and result.get('type') == 'dataframe' else None
             self.execution_history.append(execution_record)
             
             return {
                 'success': True,
                 'result': result,
                 'error': None,
-                'local_vars': {k: str(v)[:100] for k, v in local_namespace.items() 
+                'local_vars': {k: _summarize_value(v) for k, v in local_namespace.items()
                               if not k.startswith('_')}
             }
             
         except Exception as e:
             error_trace = traceback.format_exc()
             execution_record['success'] = False
-            execution_record['error'] = str(e)
+            execution_record['error'] = str(e)[:500]
             self.execution_history.append(execution_record)
             
             # 记录到系统日志 (便于调试 SyntaxError)
-            get_logger().add_log("ERROR", f"Execution failed: {str(e)}", details={
+            self._logger.add_log("ERROR", f"Execution failed: {str(e)}", details={
                 "code": code,
                 "traceback": error_trace
             })
@@ -257,15 +406,13 @@ class CodeSandbox:
     
     def cleanup_temp(self, max_age_hours: int = 24):
         """清理过期的临时文件"""
-        import time
-        current_time = time.time()
-        max_age_seconds = max_age_hours * 3600
+        cutoff = time.time() - max_age_hours * 3600
         
-        for file_path in self.temp_dir.iterdir():
-            if file_path.is_file():
-                file_age = current_time - file_path.stat().st_mtime
-                if file_age > max_age_seconds:
-                    file_path.unlink()
+        # scandir 在遍历目录时一并取得文件类型，省去逐个文件的 is_file 调用
+        with os.scandir(self.temp_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
 
 
 # 全局沙箱实例
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 服务端模块以扁平方式互相导入（from db_engine import ...），测试时同样从 server 目录导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,25 @@
+"""AI 代理辅助函数测试"""
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('httpx')
+
+from ai_agent import _referenced_tables
+
+
+def test_referenced_tables_ignores_case():
+    code = "db.execute('UPDATE Orders SET qty = 0 WHERE id IN (SELECT id FROM customers)')"
+    
+    assert _referenced_tables(code, ['orders', 'customers', 'products']) == ['orders', 'customers']
+
+
+@pytest.mark.parametrize('code', [
+    "db.sql('SELECT * FROM customers').insert_into(name)",
+    "db.sql('SELECT * FROM customers').to_table('x')",
+    "db.sql('SELECT * FROM customers').create_view('v')",
+])
+def test_relation_writes_snapshot_all_tables(code):
+    tables = ['orders', 'customers']
+    
+    assert _referenced_tables(code, tables) == tables
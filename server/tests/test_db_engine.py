@@ -0,0 +1,130 @@
+"""DataEngine 回归测试"""
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('duckdb')
+
+from db_engine import DataEngine, quote_identifier
+
+
+@pytest.fixture
+def engine():
+    return DataEngine()
+
+
+def test_inspect_columns_keeps_native_types(engine):
+    df = pd.DataFrame({
+        'amount': [1.0, 2.5, 1.0],
+        'day': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-01']),
+        'city': ['上海', '北京', '上海'],
+    })
+    engine.load_dataframe(df, 'orders')
+    specs = [('orders', 'amount', 10), ('orders', 'day', 10), ('orders', 'city', 1)]
+    
+    batched = engine.inspect_columns(specs)
+    
+    assert list(batched) == specs
+    for spec in specs:
+        assert batched[spec] == engine.inspect_column(*spec)
+
+
+def test_sequential_scroll_pages_by_rowid(engine, monkeypatch):
+    engine.load_dataframe(pd.DataFrame({'n': range(1000)}), 'numbers')
+    
+    issued = []
+    statement = engine._statement
+    
+    def recording_statement(kind, table_name, column_name=None):
+        sql = statement(kind, table_name, column_name)
+        if kind.startswith('view'):
+            issued.append(sql)
+        return sql
+    
+    monkeypatch.setattr(engine, '_statement', recording_statement)
+    
+    rows = []
+    for offset in range(0, 500, 100):
+        rows += [r['n'] for r in engine.get_view_window('numbers', offset, 100)['data']]
+    
+    assert rows == list(range(500))
+    assert len(issued) == 5
+    # 只有首屏需要 OFFSET，之后顺序向下滚动都按 rowid 续读
+    assert all('OFFSET' not in sql.upper() for sql in issued[1:])
+    assert all('rowid >' in sql for sql in issued[1:])
+
+
+@pytest.mark.parametrize('table_name', ['2024_sales', 'select', 'order'])
+def test_create_table_quotes_table_name(engine, table_name):
+    pa = pytest.importorskip('pyarrow')
+    
+    with engine.conn.cursor() as cur:
+        engine._create_table_from(cur, table_name, pa.table({'a': [1, 2]}))
+        count = cur.execute(f'SELECT count(*) FROM {quote_identifier(table_name)}').fetchone()[0]
+    
+    assert count == 2
+
+
+def test_load_dataframe_keeps_int64(engine):
+    loaded = engine.load_dataframe(pd.DataFrame({'qty': [100000], 'price': [50000]}), 'sales')
+    
+    with engine.conn.cursor() as cur:
+        assert cur.execute(f'SELECT qty * price FROM {loaded["table_name"]}').fetchone()[0] == 5_000_000_000
+        cur.execute(f'UPDATE {loaded["table_name"]} SET qty = 5000000000')
+
+
+def test_describe_refreshed_after_dml(engine):
+    engine.load_dataframe(pd.DataFrame({'city': ['上海市', '北京']}), 'stores')
+    assert '上海市' in engine.describe_table('stores')
+    
+    with engine.conn.cursor() as cur:
+        cur.execute("UPDATE stores SET city = '上海' WHERE city = '上海市'")
+    engine.mark_modified()
+    engine.refresh_metadata()
+    
+    assert '上海市' not in engine.describe_table('stores')
+    assert '上海市' not in engine.describe_table_bytes('stores').decode('utf-8')
+
+
+def test_execute_sql_returns_float_aggregates(engine):
+    engine.load_dataframe(pd.DataFrame({'qty': [4, 6]}), 'items')
+    
+    data, columns = engine.execute_sql('SELECT SUM(qty) AS total FROM items')
+    
+    assert columns == ['total']
+    assert data == [{'total': 10.0}] and isinstance(data[0]['total'], float)
+
+
+def test_excel_export_rejects_too_many_rows(engine, tmp_path, monkeypatch):
+    engine.load_dataframe(pd.DataFrame({'n': range(10)}), 'big')
+    monkeypatch.setattr(engine, 'EXCEL_MAX_ROWS', 10)
+    
+    with pytest.raises(ValueError, match='format=parquet'):
+        engine.export_table_as_excel('big', str(tmp_path / 'big.xlsx'))
+    
+    monkeypatch.setattr(engine, 'EXCEL_MAX_ROWS', 11)
+    engine.export_table_as_excel('big', str(tmp_path / 'big.xlsx'))
+
+
+def test_schema_uses_duckdb_type_names(engine, tmp_path):
+    df = pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']})
+    from_df = engine.load_dataframe(df, 'from_df')
+    csv_path = tmp_path / 'from_csv.csv'
+    df.to_csv(csv_path, index=False)
+    from_csv = engine.load_csv(str(csv_path), 'from_csv')
+    
+    assert from_df['schema'] == from_csv['schema'] == {'id': 'BIGINT', 'name': 'VARCHAR'}
+
+
+def test_excel_integer_columns_stay_integer(engine, tmp_path):
+    xlsxwriter = pytest.importorskip('xlsxwriter')
+    path = tmp_path / 'items.xlsx'
+    workbook = xlsxwriter.Workbook(str(path))
+    worksheet = workbook.add_worksheet()
+    for i, row in enumerate([['id', 'price', 'qty'], [1, 1.5, 3], [2, 2.0, None]]):
+        worksheet.write_row(i, 0, row)
+    workbook.close()
+    
+    loaded = engine.load_excel(str(path), 'items')
+    
+    assert loaded['schema'] == {'id': 'BIGINT', 'price': 'DOUBLE', 'qty': 'BIGINT'}
@@ -3,18 +3,24 @@ UI Command Queue - 管理前端 UI 命令的队列
 用于后端 AI 生成的 UI 命令传递给前端执行
 """
 
-from typing import Any, Dict, List, Optional
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
 import uuid
 import time
+import threading
 
 
 class UICommandQueue:
     """UI 命令队列 - 单例模式"""
     
     def __init__(self):
-        self.pending: List[Dict[str, Any]] = []
-        self.executed: List[Dict[str, Any]] = []
         self.max_history = 100
+        self.pending: List[Dict[str, Any]] = []
+        # 定长环形缓冲：超出 max_history 时自动丢弃最旧的记录
+        self.executed: Deque[Dict[str, Any]] = deque(maxlen=self.max_history)
+        # 请求处理可能并发（线程池），入队与取出之间加锁，命令不会丢失或重复下发
+        self._lock = threading.Lock()
     
     def add(self, command: Dict[str, Any]) -> str:
         """添加一条 UI 命令到队列
@@ -31,7 +37,8 @@ class UICommandQueue:
             'timestamp': time.time(),
             **command
         }
-        self.pending.append(entry)
+        with self._lock:
+            self.pending.append(entry)
         return cmd_id
     
     def add_batch(self, commands: List[Dict[str, Any]]) -> List[str]:
@@ -43,7 +50,14 @@ class UICommandQueue:
         Returns:
             命令 ID 列表
         """
-        return [self.add(cmd) for cmd in commands]
+        # 一次读取全部随机字节、取一次时间戳；ID 格式与 add 相同（8 位十六进制）
+        raw = os.urandom(4 * len(commands)).hex()
+        now = time.time()
+        ids = [raw[i * 8:(i + 1) * 8] for i in range(len(commands))]
+        entries = [{'id': cmd_id, 'timestamp': now, **cmd} for cmd_id, cmd in zip(ids, commands)]
+        with self._lock:
+            self.pending.extend(entries)
+        return ids
     
     def get_pending(self) -> List[Dict[str, Any]]:
         """获取并清空待执行的命令
@@ -51,15 +65,11 @@ class UICommandQueue:
         Returns:
             待执行的命令列表
         """
-        cmds = self.pending.copy()
-        # 将已获取的命令移到历史记录
-        self.executed.extend(cmds)
-        self.pending.clear()
-        
-        # 限制历史记录大小
-        if len(self.executed) > self.max_history:
-            self.executed = self.executed[-self.max_history:]
-        
+        with self._lock:
+            # 直接换入新列表，无需复制再清空
+            cmds, self.pending = self.pending, []
+            # 将已获取的命令移到历史记录
+            self.executed.extend(cmds)
         return cmds
     
     def peek_pending(self) -> List[Dict[str, Any]]:
@@ -68,7 +78,8 @@ class UICommandQueue:
         Returns:
             待执行的命令列表
         """
-        return self.pending.copy()
+        with self._lock:
+            return self.pending.copy()
     
     def get_history(self, limit: int = 20) -> List[Dict[str, Any]]:
         """获取最近执行的命令历史
@@ -79,12 +90,14 @@ class UICommandQueue:
         Returns:
             命令历史列表
         """
-        return self.executed[-limit:]
+        with self._lock:
+            return list(self.executed)[-limit:]
     
     def clear(self):
         """清空所有命令"""
-        self.pending.clear()
-        self.executed.clear()
+        with self._lock:
+            self.pending = []
+            self.executed.clear()
 
 
 # 全局单例
@@ -1,19 +1,25 @@
 import uuid
-from typing import List, Tuple, Dict
-from db_engine import get_engine, DataEngine
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional
+from db_engine import get_engine, DataEngine, quote_identifier
 
 class UndoManager:
     """管理表格操作的撤回 (基于 DuckDB 快照)"""
     
+    # 同时复制快照表的最大线程数
+    SNAPSHOT_WORKERS = 4
+    
     def __init__(self):
         self.history_stack: List[Dict] = [] # 栈顶是最近的操作
+        # 数据引擎是进程级单例，生命周期内不会替换
+        self._engine: DataEngine = get_engine()
         
     def create_snapshot(self, table_names: List[str]) -> str:
         """为指定表创建快照"""
         if not table_names:
             return None
             
-        engine = get_engine()
+        engine = self._engine
         snapshot_id = str(uuid.uuid4())[:8]
         
         snapshot_info = {
@@ -21,18 +27,28 @@ class UndoManager:
             'tables': []
         }
         
-        for table in table_names:
-            if table in engine.tables:
-                # 创建备份表: _snap_{id}_{table}
-                snap_table_name = f"_snap_{snapshot_id}_{table}"
-                try:
-                    engine.conn.execute(f'CREATE TABLE "{snap_table_name}" AS SELECT * FROM "{table}"')
-                    snapshot_info['tables'].append({
-                        'original': table,
-                        'backup': snap_table_name
-                    })
-                except Exception as e:
-                    print(f"创建快照失败 {table}: {e}")
+        def snapshot_table(table: str) -> Optional[Dict]:
+            # 创建备份表: _snap_{id}_{table}；每个线程使用独立游标
+            snap_table_name = f"_snap_{snapshot_id}_{table}"
+            try:
+                with engine.conn.cursor() as cur:
+                    cur.execute(f'CREATE TABLE {quote_identifier(snap_table_name)} AS SELECT * FROM {quote_identifier(table)}')
+                return {
+                    'original': table,
+                    'backup': snap_table_name
+                }
+            except Exception as e:
+                print(f"创建快照失败 {table}: {e}")
+                return None
+        
+        tables = [table for table in table_names if table in engine.tables]
+        if len(tables) > 1:
+            # 多张表的复制互不依赖，并发执行
+            with ThreadPoolExecutor(max_workers=min(self.SNAPSHOT_WORKERS, len(tables))) as pool:
+                results = list(pool.map(snapshot_table, tables))
+        else:
+            results = [snapshot_table(table) for table in tables]
+        snapshot_info['tables'] = [item for item in results if item]
         
         if snapshot_info['tables']:
             self.history_stack.append(snapshot_info)
@@ -49,27 +65,31 @@ class UndoManager:
             
         # 弹出最近的快照
         snapshot = self.history_stack.pop()
-        engine = get_engine()
+        engine = self._engine
         restored_tables = []
         
         try:
+            # 1. 恢复表数据：所有表的删除与重命名在同一事务中完成，中途失败时整体回滚
+            with engine.conn.cursor() as cur:
+                cur.execute("BEGIN TRANSACTION")
+                try:
+                    for item in snapshot['tables']:
+                        original = quote_identifier(item['original'])
+                        # 先删除当前的（可能已被修改的）表，再将备份表重命名回原表名
+                        cur.execute(f"DROP TABLE IF EXISTS {original}")
+                        cur.execute(f"ALTER TABLE {quote_identifier(item['backup'])} RENAME TO {original}")
+                    cur.execute("COMMIT")
+                except Exception:
+                    cur.execute("ROLLBACK")
+                    # 回滚后备份表仍在，快照可以再次用于撤回
+                    self.history_stack.append(snapshot)
+                    raise
+            
+            # 2. 更新引擎元数据 (重新注册)
+            # 数据已在 DuckDB 中，只读取 DESCRIBE 与行数，不经过 pandas 往返
             for item in snapshot['tables']:
-                original = item['original']
-                backup = item['backup']
-                
-                # 1. 恢复表数据
-                # 先删除当前的（可能已被修改的）表
-                engine.conn.execute(f'DROP TABLE IF EXISTS "{original}"')
-                # 将备份表重命名回原表名
-                engine.conn.execute(f'ALTER TABLE "{backup}" RENAME TO "{original}"')
-                
-                # 2. 更新引擎元数据 (重新注册)
-                # 使用 db_engine 的内部方法稍显麻烦，直接查一遍元数据
-                # 或者调用 engine._register_dataframe? 不，直接读 SQL
-                df = engine.conn.execute(f'SELECT * FROM "{original}"').fetchdf()
-                engine._register_dataframe(df, original)
-                
-                restored_tables.append(original)
+                engine._register_table(item['original'])
+                restored_tables.append(item['original'])
                 
             return {
                 'success': True, 
@@ -83,13 +103,17 @@ class UndoManager:
 
     def _cleanup_snapshot(self, snapshot):
         """清理过期的快照表"""
-        engine = get_engine()
-        for item in snapshot['tables']:
-            backup = item['backup']
-            try:
-                engine.conn.execute(f'DROP TABLE IF EXISTS "{backup}"')
-            except:
-                pass
+        engine = self._engine
+        # 多条 DROP 合并为一次执行
+        statements = "; ".join(
+            f"DROP TABLE IF EXISTS {quote_identifier(item['backup'])}" for item in snapshot['tables']
+        )
+        if not statements:
+            return
+        try:
+            engine.conn.execute(statements)
+        except Exception as e:
+            print(f"清理快照失败 {snapshot['id']}: {e}")
 
 
 # 全局单例